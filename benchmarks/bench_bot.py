@@ -0,0 +1,186 @@
+"""
+End-to-end benchmark of NestrCog against a fake Nestr API and a fake Discord guild.
+
+Runs /sync, /sync again (no changes), a background re-sync, /todos, /roles, /accountable, a burst of
+webhook messages and /unsync, and reports wall time, Nestr and Discord call
+counts and peak Python memory per scenario. Every round starts from an empty
+database. Save a run with --json and compare a later one against it with --compare.
+
+Usage: python -m benchmarks.bench_bot [--rounds 3] [--depth 3 --width 3 --roles 5]
+                                      [--latency 0.02] [--json run.json] [--compare base.json]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from statistics import median
+
+from benchmarks.fake_nestr import Workspace, FakeNestr
+from benchmarks.fake_discord import FakeBot, FakeGuild, FakeMember, FakeContext, FakeMessage, FakeChannel
+from benchmarks.fake_discord import first_button, next_button
+
+NESTR_ID = "bench-user"
+
+
+async def drain(cog):
+    """Waits until the webhook workers and the notification buffer are idle"""
+    while cog.ingest.depth or cog.notifier.pending or cog.notifier.timers or cog.notifier.locks:
+        await asyncio.sleep(0.005)
+    await asyncio.gather(*(queue.join() for queue in cog.ingest.queues))
+
+
+async def run_round(args, server, trace=False):
+    """One pass over all scenarios with a fresh cog and database"""
+    from cogs.nestr import NestrCog
+    from utils.metrics import metrics
+
+    for path in (os.environ['DB_PATH'], os.environ['SNAPSHOT_PATH']):
+        if os.path.exists(path):
+            os.remove(path)
+
+    guild = FakeGuild(latency=args.discord_latency)
+    author = FakeMember(guild, 4242)
+    bot = FakeBot(guild, author)
+    bot.nestr_client = server.client
+    cog = NestrCog(bot)
+    # the fake guild's webhook has no real Discord url behind it
+    async def delete_webhook_message(message):
+        await guild.call('delete_webhook_message')
+    cog.delete_webhook_message = delete_webhook_message
+    cog.db.upsert('discord_id', str(author.id), {'discord_id': str(author.id), 'nestr_id': NESTR_ID, 'token': "token"})
+    ctx = FakeContext(bot, guild, author)
+
+    async def webhook_burst():
+        channel = FakeChannel(guild)
+        for i in range(args.burst):
+            member_id = 1000 + i % args.users
+            if i % 10 == 0:
+                content = f"!webhook-login|{member_id}|nestr-{member_id}|token-{member_id}"
+            else:
+                content = f"!webhook-notification|{member_id}|Update {i}|Something changed in role {i}|https://nestr.invalid/n/{i}"
+            await cog.on_message(FakeMessage(guild, content, channel=channel))
+        await drain(cog)
+
+    scenarios = [
+        ('/sync', first_button, lambda: cog.sync.func(cog, ctx)),
+        ('/sync (no changes)', first_button, lambda: cog.sync.func(cog, ctx)),
+        ('background re-sync', None, lambda: cog.resync_workspace(guild, cog.db.workspaces(guild.id)[0], 50)),
+        ('/todos', next_button, lambda: cog.todos.func(cog, ctx)),
+        ('/roles', next_button, lambda: cog.roles.func(cog, ctx)),
+        ('/accountable', next_button, lambda: cog.accountable.func(cog, ctx, search=args.search)),
+        ('/accountable live', next_button, lambda: cog.accountable.func(cog, ctx, search=args.search, live=True)),
+        ('webhook burst', None, webhook_burst),
+        ('/unsync', first_button, lambda: cog.unsync.func(cog, ctx)),
+    ]
+    results = {}
+    try:
+        for name, choose, run in scenarios:
+            bot.choose = choose or (lambda buttons: None)
+            server.calls.clear()
+            guild.calls.clear()
+            if trace:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            await run()
+            elapsed = time.perf_counter() - started
+            results[name] = {'seconds': elapsed,
+                             'nestr_calls': sum(server.calls.values()),
+                             'discord_calls': sum(guild.calls.values())}
+            if trace:
+                results[name]['peak_kib'] = (tracemalloc.get_traced_memory()[1] - baseline) / 1024
+    finally:
+        cog.db.flush(durable=True)
+        metrics.remove_gauges('nestr_cog_')
+        await cog._shutdown()
+        cog.db.close()
+    return results
+
+
+def report(rounds, traced, baseline=None):
+    print(f"{'scenario':22} {'wall ms':>9} {'nestr':>6} {'discord':>8} {'peak KiB':>9}" + ("   vs baseline" if baseline else ""))
+    summary = {}
+    for name in rounds[0]:
+        row = {'seconds': median(run[name]['seconds'] for run in rounds),
+               'nestr_calls': rounds[-1][name]['nestr_calls'],
+               'discord_calls': rounds[-1][name]['discord_calls'],
+               'peak_kib': traced[name]['peak_kib'] if traced else None}
+        summary[name] = row
+        peak = f"{row['peak_kib']:9.0f}" if row['peak_kib'] is not None else f"{'-':>9}"
+        line = f"{name:22} {row['seconds'] * 1000:9.1f} {row['nestr_calls']:6d} {row['discord_calls']:8d} {peak}"
+        before = (baseline or {}).get(name)
+        if before:
+            line += f"   {(row['seconds'] / before['seconds'] - 1) * 100:+6.1f}% time"
+            line += f" {row['nestr_calls'] - before['nestr_calls']:+d} nestr {row['discord_calls'] - before['discord_calls']:+d} discord"
+        print(line)
+    return summary
+
+
+async def bench(args):
+    workspace = Workspace(NESTR_ID, depth=args.depth, width=args.width, roles=args.roles,
+                          accountabilities=args.accountabilities, todos=args.todos)
+    print(f"workspace: {workspace.stats()}, nestr latency {args.latency * 1000:.0f}ms, "
+          f"discord latency {args.discord_latency * 1000:.0f}ms, {args.rounds} rounds, {os.environ['DB_BACKEND']} storage")
+    server = await FakeNestr(workspace, latency=args.latency).start()
+
+    from utils.nestr_client import NestrClient
+    server.client = NestrClient(server.url)
+    try:
+        rounds = [await run_round(args, server) for _ in range(args.rounds)]
+        traced = None
+        if args.memory:
+            tracemalloc.start()
+            traced = await run_round(args, server, trace=True)
+            tracemalloc.stop()
+    finally:
+        await server.client.close()
+        await server.close()
+    return rounds, traced
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark NestrCog against a fake Nestr API and Discord guild")
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--depth', type=int, default=3, help="circle levels below the anchor circle")
+    parser.add_argument('--width', type=int, default=3, help="subcircles per circle")
+    parser.add_argument('--roles', type=int, default=5, help="roles per circle")
+    parser.add_argument('--accountabilities', type=int, default=3, help="accountabilities per role")
+    parser.add_argument('--todos', type=int, default=4, help="todos per role")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds per Nestr request")
+    parser.add_argument('--discord-latency', type=float, default=0.0, help="seconds per Discord call")
+    parser.add_argument('--burst', type=int, default=200, help="webhook messages in the burst")
+    parser.add_argument('--users', type=int, default=20, help="distinct users in the burst")
+    parser.add_argument('--search', default="topic-3", help="/accountable search text")
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="skip the tracemalloc round")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nestr-bench-")
+    # read by the modules at import time, so set before importing the cog
+    os.environ['DB_BACKEND'] = args.backend
+    os.environ['DB_PATH'] = os.path.join(workdir, "db.sqlite3" if args.backend == 'sqlite' else "db.json")
+    os.environ['SNAPSHOT_PATH'] = os.path.join(workdir, "warm_state.json")
+    os.environ.setdefault('NOTIFY_WINDOW', "0.05")
+    # re-syncs are benchmarked as a scenario, not on a timer
+    os.environ['RESYNC_INTERVAL'] = "0"
+
+    rounds, traced = asyncio.run(bench(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as handle:
+            baseline = json.load(handle)['scenarios']
+    summary = report(rounds, traced, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as handle:
+            json.dump({'args': vars(args), 'scenarios': summary}, handle, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of utils.text.html_to_text against the BeautifulSoup calls it replaces.
+
+Usage: python -m benchmarks.bench_text [--rounds 2000]
+"""
+
+import argparse
+import timeit
+
+from bs4 import BeautifulSoup as bs
+
+from utils.text import html_to_text, _html_to_text
+
+# realistic Nestr role/circle/todo titles and purposes
+SAMPLES = [
+    "Facilitator",
+    "Secretary",
+    "Lead Link",
+    "Rep Link",
+    "Marketing & Communication",
+    "Ops Team",
+    "Prepare the Q3 budget review",
+    "<b>Website</b> Steward",
+    "Publishing the monthly newsletter &amp; social posts",
+    "<p>Healthy finances that enable the organization to pursue its purpose</p>",
+    "<p>Make sure <strong>every</strong> customer request is answered within <em>24h</em></p><p><br></p>",
+    "Follow up with <a href=\"https://app.nestr.io/n/abc\">supplier</a> about the invoice",
+    "<ul><li>Onboarding of new members</li><li>Maintaining the wiki</li></ul>",
+]
+
+
+def bench(rounds):
+    expected = [bs(sample, "html.parser").text for sample in SAMPLES]
+    actual = [html_to_text(sample) for sample in SAMPLES]
+    mismatches = [(sample, e, a) for sample, e, a in zip(SAMPLES, expected, actual) if e != a]
+
+    def run_bs():
+        for sample in SAMPLES:
+            bs(sample, "html.parser").text
+
+    def run_cold():
+        _html_to_text.cache_clear()
+        for sample in SAMPLES:
+            html_to_text(sample)
+
+    def run_warm():
+        for sample in SAMPLES:
+            html_to_text(sample)
+
+    results = {
+        'bs4 html.parser': timeit.timeit(run_bs, number=rounds),
+        'html_to_text (cold cache)': timeit.timeit(run_cold, number=rounds),
+        'html_to_text (memoized)': timeit.timeit(run_warm, number=rounds),
+    }
+    calls = rounds * len(SAMPLES)
+    baseline = results['bs4 html.parser']
+    for name, seconds in results.items():
+        print(f"{name:28} {seconds / calls * 1e6:9.2f} µs/call  {baseline / seconds:7.1f}x")
+    for sample, e, a in mismatches:
+        print(f"MISMATCH {sample!r}: bs4={e!r} html_to_text={a!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark html_to_text against BeautifulSoup")
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+    bench(args.rounds)
+
+
+if __name__ == '__main__':
+    main()
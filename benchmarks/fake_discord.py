@@ -0,0 +1,210 @@
+"""
+In-process stand-ins for the discord.py and discord-py-interactions objects NestrCog uses.
+
+Every Discord call is counted on the FakeGuild and takes `latency` seconds.
+"""
+
+import asyncio
+import itertools
+from collections import Counter
+
+_ids = itertools.count(10 ** 17)
+
+
+class FakeObject:
+    """A role, text channel or category"""
+
+    def __init__(self, guild, kind, name, topic=None, category=None):
+        self.id = next(_ids)
+        self.guild = guild
+        self.kind = kind
+        self.name = name
+        self.topic = topic
+        self.category = category
+        self.channels = []
+
+    @property
+    def mention(self):
+        return f"<@&{self.id}>"
+
+    async def edit(self, **fields):
+        await self.guild.call('edit')
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    async def delete(self):
+        await self.guild.call('delete')
+        for collection in (self.guild.roles, self.guild.channels):
+            if self in collection:
+                collection.remove(self)
+        if self.category is not None and self in self.category.channels:
+            self.category.channels.remove(self)
+
+
+class FakeWebhook:
+    def __init__(self, name):
+        self.id = next(_ids)
+        self.name = name
+        self.token = "token"
+        self.url = f"https://discord.invalid/api/webhooks/{self.id}/{self.token}"
+
+
+class FakeMember:
+    def __init__(self, guild, member_id):
+        self.id = member_id
+        self.guild = guild
+        self.mention = f"<@{member_id}>"
+        self.name = f"member-{member_id}"
+
+    async def send(self, content=None, embed=None):
+        await self.guild.call('dm')
+
+
+class FakeGuild:
+    """Records the REST calls NestrCog makes, members are only known over fetch_member"""
+
+    def __init__(self, latency=0.0):
+        self.id = next(_ids)
+        self.name = "Bench Guild"
+        self.latency = latency
+        self.calls = Counter()
+        self.roles = []
+        self.channels = []
+        self.hooks = [FakeWebhook("Nestr")]
+
+    async def call(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    @property
+    def categories(self):
+        return [channel for channel in self.channels if channel.kind == 'category']
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.channels if channel.id == channel_id), None)
+
+    def get_member(self, member_id):
+        return None
+
+    async def fetch_member(self, member_id):
+        await self.call('fetch_member')
+        return FakeMember(self, member_id)
+
+    async def webhooks(self):
+        await self.call('webhooks')
+        return list(self.hooks)
+
+    async def create_role(self, name, mentionable=True):
+        await self.call('create_role')
+        role = FakeObject(self, 'role', name)
+        self.roles.append(role)
+        return role
+
+    async def create_category(self, name, overwrites=None, reason=None):
+        await self.call('create_category')
+        category = FakeObject(self, 'category', name)
+        self.channels.append(category)
+        return category
+
+    async def create_text_channel(self, name, category=None, topic=None):
+        await self.call('create_text_channel')
+        channel = FakeObject(self, 'text', name, topic, category)
+        self.channels.append(channel)
+        if category is not None:
+            category.channels.append(channel)
+        return channel
+
+
+class FakeMessage:
+    def __init__(self, guild, content, components=None, channel=None):
+        self.id = next(_ids)
+        self.guild = guild
+        self.channel = channel
+        self.content = content
+        self.components = components
+
+    async def edit(self, **fields):
+        await self.guild.call('edit_message')
+        self.components = fields.get('components', self.components)
+
+
+class FakeChannel:
+    def __init__(self, guild):
+        self.id = next(_ids)
+        self.guild = guild
+
+
+class FakeHTTP:
+    """The interaction webhook client progress_reporter edits responses through"""
+
+    def __init__(self, guild):
+        self.guild = guild
+
+    async def edit(self, payload, token, message_id="@original"):
+        await self.guild.call('edit_response')
+
+
+class FakeContext:
+    """SlashContext and ComponentContext in one, the last sent components are what FakeBot clicks"""
+
+    def __init__(self, bot, guild, author, custom_id=None):
+        self.bot = bot
+        self.guild = guild
+        self.author = author
+        self.author_id = author.id
+        self.custom_id = custom_id
+        self.component_id = custom_id
+        self._http = FakeHTTP(guild)
+        self._token = "interaction-token"
+
+    async def send(self, content=None, embed=None, components=None, hidden=False):
+        await self.guild.call('send')
+        self.bot.components = components
+        return FakeMessage(self.guild, content, components)
+
+    async def defer(self, hidden=False, edit_origin=False):
+        await self.guild.call('defer')
+
+    async def edit_origin(self, content=None, embed=None, components=None):
+        await self.guild.call('edit_origin')
+        self.bot.components = components
+
+
+class FakeBot:
+    """
+    Answers wait_for("component") by clicking a button of the last sent components:
+    the one `choose(buttons)` returns, or a timeout when it returns None.
+    """
+
+    def __init__(self, guild, author, choose=None):
+        self.guild = guild
+        self.author = author
+        self.guilds = [guild]
+        self.components = None
+        self.choose = choose or (lambda buttons: None)
+        self.nestr_client = None
+
+    async def wait_for(self, event, check=None, timeout=None):
+        buttons = [button for row in self.components or [] for button in row['components']]
+        custom_id = self.choose(buttons)
+        if custom_id is None:
+            raise asyncio.TimeoutError()
+        ctx = FakeContext(self, self.guild, self.author, custom_id)
+        if check is not None and not check(ctx):
+            raise asyncio.TimeoutError()
+        return ctx
+
+
+def first_button(buttons):
+    """Picks the first enabled button, e.g. the first workspace of /sync"""
+    return next((button['custom_id'] for button in buttons if not button.get('disabled')), None)
+
+
+def next_button(buttons):
+    """Pages through a paginator until Next is disabled"""
+    return next((button['custom_id'] for button in buttons
+                 if button['custom_id'].endswith(':next') and not button.get('disabled')), None)
@@ -0,0 +1,144 @@
+"""
+Local stand-in for the Nestr API, serving a synthetic workspace for the benchmarks.
+
+Serves /api/search/..., /api/discordsync/... and /api/n/inbox with a configurable
+latency, and counts the requests it answers per endpoint.
+"""
+
+import asyncio
+from collections import Counter
+from urllib.parse import unquote
+
+from aiohttp import web
+
+
+class Workspace:
+    """
+    Synthetic workspace: a tree of circles `depth` levels deep and `width` wide,
+    with `roles` roles per circle, and `accountabilities` and `todos` per role.
+    Every `assign_every`th role (and its todos) is assigned to `nestr_id`.
+    """
+
+    def __init__(self, nestr_id, workspace_id="ws0", title="Bench Workspace", depth=3, width=3, roles=5,
+                 accountabilities=3, todos=4, assign_every=3):
+        self.nestr_id = nestr_id
+        self.workspace_id = workspace_id
+        self.items = {'anchor': [], 'circle': [], 'role': [], 'accountability': [], 'todo': []}
+        self.items['anchor'].append(self._node(workspace_id, title, None, [], purpose="<p>Bench purpose</p>"))
+        counter = iter(range(1, 10 ** 9))
+
+        def add_circle(parent_id, ancestors, level):
+            for role_index in range(roles):
+                n = next(counter)
+                role_id = f"r{n}"
+                assigned = n % assign_every == 0
+                self.items['role'].append(self._node(
+                    role_id, f"Role {n}", parent_id, ancestors,
+                    purpose=f"<p>Purpose of <b>role</b> {n}</p>", users=[nestr_id] if assigned else []))
+                for acc_index in range(accountabilities):
+                    self.items['accountability'].append(self._node(
+                        f"a{n}-{acc_index}", f"<p>Keeping topic-{n % 17} and area-{acc_index} in order</p>",
+                        role_id, ancestors + [role_id]))
+                for todo_index in range(todos):
+                    self.items['todo'].append(self._node(
+                        f"t{n}-{todo_index}", f"Follow up on <em>item {todo_index}</em> of role {n}",
+                        role_id, ancestors + [role_id], users=[nestr_id] if assigned else [], completable=True))
+            if level >= depth:
+                return
+            for circle_index in range(width):
+                n = next(counter)
+                circle_id = f"c{n}"
+                self.items['circle'].append(self._node(
+                    circle_id, f"Circle {n}", parent_id, ancestors, purpose=f"<p>Purpose of circle {n}</p>"))
+                add_circle(circle_id, ancestors + [circle_id], level + 1)
+
+        add_circle(workspace_id, [workspace_id], 1)
+
+    @staticmethod
+    def _node(node_id, title, parent_id, ancestors, purpose="", users=(), completable=False):
+        return {'_id': node_id, 'title': title, 'purpose': purpose, 'parentId': parent_id,
+                'ancestors': list(ancestors), 'users': list(users), 'completable': completable}
+
+    LABELS = {'circleplus-anchor-circle': 'anchor',
+              'circleplus-circle': 'circle',
+              'circleplus-role': 'role',
+              'circleplus-accountability': 'accountability'}
+
+    def search(self, query, nestr_id, context_id=None):
+        """Answers the subset of the Nestr search syntax the bot uses"""
+        kind = None
+        assignee = None
+        words = []
+        for token in query.split():
+            if token.startswith('label:!project') or token == 'has:completable':
+                kind = 'todo'
+            elif token.startswith('label:'):
+                kind = kind or self.LABELS.get(token[len('label:'):])
+            elif token.startswith('assignee:'):
+                assignee = token[len('assignee:'):]
+                assignee = nestr_id if assignee == 'me' else assignee
+            elif ':' not in token:
+                words.append(token.lower())
+        results = self.items.get(kind, [])
+        if context_id is not None:
+            results = [item for item in results if context_id in item['ancestors'] or item['_id'] == context_id]
+        if assignee is not None:
+            results = [item for item in results if assignee in item['users']]
+        if words:
+            results = [item for item in results if all(word in item['title'].lower() for word in words)]
+        return results
+
+    def stats(self):
+        return {kind: len(items) for kind, items in self.items.items()}
+
+
+class FakeNestr:
+    """aiohttp server answering like Nestr, `latency` seconds per request"""
+
+    def __init__(self, workspace, latency=0.0, host='127.0.0.1'):
+        self.workspace = workspace
+        self.latency = latency
+        self.host = host
+        self.port = None
+        self.calls = Counter()
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/api"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api/search/{query:.*}', self.handle_search)
+        app.router.add_post('/api/discordsync/{workspace_id}', self.handle_discordsync)
+        app.router.add_post('/api/n/inbox', self.handle_inbox)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _respond(self, endpoint, body):
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response(body)
+
+    async def handle_search(self, request):
+        query = unquote(request.match_info['query'])
+        limit = int(request.query.get('limit', 100))
+        skip = int(request.query.get('skip', 0))
+        results = self.workspace.search(query, request.headers.get('X-User-Id'), request.query.get('contextId'))
+        return await self._respond('search', {'status': 'success', 'data': results[skip:skip + limit]})
+
+    async def handle_discordsync(self, request):
+        return await self._respond('discordsync', {'status': 'success'})
+
+    async def handle_inbox(self, request):
+        data = await request.post()
+        return await self._respond('inbox', {'status': 'success', 'data': {'_id': 'inbox-item', 'title': data.get('title')}})
@@ -2,6 +2,8 @@ import logging.config
 import discord
 from discord.ext import commands
 from discord_slash import cog_ext, SlashContext
+from utils.metrics import metrics
+from utils.text import clip
 
 
 class Admin(commands.Cog, name='Admin'):
@@ -88,6 +90,35 @@ class Admin(commands.Cog, name='Admin'):
         msg = f'reload module error: {error}'
         await ctx.send(msg, hidden=True)
 
+    @cog_ext.cog_slash(name="stats", description="Bot performance metrics")
+    @commands.has_any_role("admin")
+    async def stats(self, ctx: SlashContext):
+        """
+        Shows command, Nestr API, storage and Discord metrics.
+        """
+        embed = discord.Embed(title="Nestr Bot Stats", color=0xED4245)
+        for title, lines in list(metrics.summary().items())[:25]:
+            embed.add_field(name=clip(title, 256), value=clip("\n".join(lines), 1024), inline=False)
+        watchdog = getattr(self.bot, 'stall_watchdog', None)
+        if watchdog is not None and watchdog.stalls and len(embed.fields) < 25:
+            embed.add_field(name=f"Event loop stalls ({watchdog.stalls}, {watchdog.blocked_seconds:.1f}s)",
+                            value=clip("\n".join(f"{total:.1f}s {count}x {origin} {site}"
+                                                  for origin, site, count, total, worst in watchdog.top(5)), 1024),
+                            inline=False)
+        if not embed.fields:
+            embed.description = "No metrics recorded yet."
+        await ctx.send(embed=embed, hidden=True)
+
+    @stats.error
+    async def stats_error(self, ctx: SlashContext, error):
+        """
+        Error catcher for stats command
+        :param ctx:
+        :param error:
+        """
+        msg = f'stats error: {error}'
+        await ctx.send(msg, hidden=True)
+
     @cog_ext.cog_slash(name="help", description="Nestr Bot Help")
     async def help(self, ctx: SlashContext):
         """
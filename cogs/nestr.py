@@ -3,30 +3,49 @@ A cog extension for the nestr info functions of the bot app
 """
 
 import os
-import re
+import random
+import asyncio
 import json
 import logging
 import logging.config
 import discord
-import requests
+import aiohttp
 import datetime as dt
 from discord.utils import get
-from discord import Webhook, RequestsWebhookAdapter
-from requests.auth import HTTPDigestAuth
-from discord.ext import commands
+from discord import Webhook, AsyncWebhookAdapter
+from discord.ext import commands, tasks
 from discord_slash.utils.manage_commands import create_option, create_choice, SlashCommandOptionType
 from discord_slash.utils.manage_components import wait_for_component, create_button, create_actionrow
 from discord_slash.model import ButtonStyle
 from discord_slash import cog_ext, SlashContext
-from tinydb import TinyDB, Query, operations
-from tinydb.storages import JSONStorage
-from tinydb.middlewares import CachingMiddleware
-from urllib.parse import quote, quote_plus, unquote
-from bs4 import BeautifulSoup as bs
-from itertools import groupby
+from urllib.parse import quote, unquote
+from utils.cache import TTLCache
+from utils.storage import open_db
+from utils.snapshot import save_snapshot, load_snapshot
+from utils.metrics import metrics
+from utils.sharding import ShardBus, is_sharded, SHARD_BUS_INTERVAL
+from utils.hierarchy import build_tree
+from utils.ingest import IngestPipeline
+from utils.paginator import EmbedPaginator, grouped
+from utils.workspace_model import GuildModel
+from utils.text import html_to_text
+from utils.notify import NotificationDispatcher
+from utils.reconcile import plan_workspace, plan_unsync, apply_plan, state_fingerprint
+from utils.nestr_client import NestrClient, NestrError, NestrAuthError, paginate, NESTR_PAGE_SIZE, NESTR_MAX_ITEMS
 
 nestr_base_url = "https://app.nestr.io"
 nestr_url = nestr_base_url+"/api"
+# max Nestr search pages in flight while loading a workspace on /sync
+sync_concurrency = int(os.getenv('NESTR_SYNC_CONCURRENCY', 8))
+# restored webhooks may have missed a webhooks_update while we were down
+webhook_snapshot_ttl = float(os.getenv('SNAPSHOT_WEBHOOK_TTL', 300))
+# background re-sync of synced workspaces every ~RESYNC_INTERVAL seconds, 0 disables it
+resync_interval = float(os.getenv('RESYNC_INTERVAL', 6 * 3600))
+resync_jitter = float(os.getenv('RESYNC_JITTER', 0.2))
+resync_tick = float(os.getenv('RESYNC_TICK', 60))
+# Nestr search pages and Discord mutations one tick may spend
+resync_nestr_budget = int(os.getenv('RESYNC_NESTR_BUDGET', 100))
+resync_discord_budget = int(os.getenv('RESYNC_DISCORD_BUDGET', 50))
 
 class NestrCog(commands.Cog, name='Nestr functions'):
     """Nestr functions"""
@@ -34,151 +53,399 @@ class NestrCog(commands.Cog, name='Nestr functions'):
     def __init__(self, bot):
         self.logger = logging.getLogger(__name__)
         self.bot = bot
-        self.db = TinyDB('/app/db.json', storage=CachingMiddleware(JSONStorage))
+        # one database handle per bot process, shared across cog reloads: the old
+        # cog's webhook workers may still be storing logins while the new one loads
+        if getattr(bot, 'nestr_db', None) is None:
+            bot.nestr_db = open_db()
+        self.db = bot.nestr_db
+        # one pooled Nestr session per bot process, shared across cog reloads
+        if getattr(bot, 'nestr_client', None) is None:
+            bot.nestr_client = NestrClient(nestr_url)
+        self.nestr = bot.nestr_client
+        # search results keyed on (nestr_id, text, context_id, limit, skip)
+        self.search_cache = TTLCache()
+        # guild_id -> {'id', 'token', 'url'} of the "Nestr" webhook, None when missing
+        self.webhooks = {}
+        # webhook messages are parsed in on_message and handled by these workers
+        self.ingest = IngestPipeline(self.handle_webhook_job, name="webhook")
+        self.http_session = None
+        # members resolved over REST, the member intent is off so the guild cache is sparse
+        self.member_cache = TTLCache(maxsize=4096, ttl=600)
+        self.notifier = NotificationDispatcher(self.get_member)
+        # guild_id -> GuildModel of the synced workspaces, loaded on first use
+        self.models = {}
+        # guild_id -> lock held while a workspace of the guild is (re-)synced
+        self.sync_locks = {}
+        # in a sharded deployment the other workers' caches are kept in step over the bus
+        self.bus = None
+        if is_sharded():
+            self.bus = ShardBus()
+            self.bus.subscribe('search_invalidate', lambda nestr_id, structure:
+                               self.invalidate_search_cache(nestr_id, structure, broadcast=False))
+            self.bus_loop.start()
+        self.restore_snapshot()
+        metrics.gauge('nestr_cog_webhook_queue_depth', lambda: self.ingest.depth)
+        metrics.gauge('nestr_cog_webhook_queue_high_water', lambda: self.ingest.high_water)
+        metrics.gauge('nestr_cog_notifications_buffered', lambda: self.notifier.stats()['buffered'])
+        metrics.gauge('nestr_cog_search_cache_size', lambda: len(self.search_cache))
+        metrics.gauge('nestr_cog_search_cache_hit_ratio', lambda: self.search_cache.stats()['hit_ratio'])
+        metrics.gauge('nestr_cog_member_cache_size', lambda: len(self.member_cache))
+        metrics.gauge('nestr_cog_db_dirty', lambda: self.db.dirty)
+        if resync_interval > 0:
+            self.resync_loop.start()
+
+    def cog_unload(self):
+        # also runs on bot shutdown, make sure pending writes hit the disk
+        self.resync_loop.cancel()
+        self.bus_loop.cancel()
+        self.db.flush(durable=True)
+        self.save_snapshot()
+        metrics.remove_gauges('nestr_cog_')
+        asyncio.ensure_future(self._shutdown())
+
+    def save_snapshot(self):
+        """Writes the warm caches to disk, restored by the next load of this cog"""
+        save_snapshot({
+            'search_cache': [[list(key), remaining, value] for key, remaining, value in self.search_cache.dump()],
+            'webhooks': {str(guild_id): hook for guild_id, hook in self.webhooks.items()},
+            'models': list(self.models),
+        })
+
+    def restore_snapshot(self):
+        """
+        Restores the caches written by save_snapshot. Search results keep their remaining ttl,
+        webhooks are trusted for `webhook_snapshot_ttl` and models are rebuilt from the database.
+        """
+        age, sections = load_snapshot()
+        if age is None:
+            return
+        searches = self.search_cache.load(
+            ((tuple(key), remaining, value) for key, remaining, value in sections.get('search_cache', [])), age)
+        if age <= webhook_snapshot_ttl:
+            self.webhooks.update((int(guild_id), hook) for guild_id, hook in sections.get('webhooks', {}).items())
+        for guild_id in sections.get('models', []):
+            self.get_workspace_model(guild_id)
+        self.logger.info('Restored %.0fs old snapshot: %s searches, %s webhooks, %s models',
+                         age, searches, len(self.webhooks), len(self.models))
+
+    async def _shutdown(self):
+        await self.ingest.close()
+        # the drained jobs wrote to the shared handle, the next cog reads it from memory
+        self.db.flush()
+        await self.notifier.close()
+        if self.bus is not None:
+            self.bus.close()
+        if self.http_session is not None:
+            await self.http_session.close()
 
     def get_loggedin_user(self, discord_id):
-        discord_id = str(discord_id)
-        User = Query()
-        res = self.db.search(User.discord_id == discord_id)
+        res = self.db.user(discord_id)
         if len(res) == 1:
             return res[0]
         if len(res) > 1:
             raise RuntimeError("More than one user found on the database!")
         return None
     
-    def get_synced_roles(self, ctx):
-        Role = Query()
-        return self.db.search((Role.guild_id == ctx.guild.id) & Role.role_id.exists())
-
-    def get_synced_circles(self, ctx):
-        Circle = Query()
-        circles = self.db.search((Circle.guild_id == ctx.guild.id) & Circle.circle_id.exists())
-        return circles
+    def get_workspace_model(self, guild_id):
+        if guild_id not in self.models:
+            self.models[guild_id] = GuildModel.from_db(self.db, guild_id)
+        return self.models[guild_id]
+
+    async def get_nestr_webhook(self, guild):
+        """
+        Returns the guild's "Nestr" webhook as {'id', 'token', 'url'}, or None.
+        Resolved once per guild and dropped again on `on_webhooks_update`.
+        """
+        if guild.id not in self.webhooks:
+            hooks = await guild.webhooks()
+            hook = next((x for x in hooks if x.name == "Nestr"), None)
+            self.webhooks[guild.id] = {'id': hook.id, 'token': hook.token, 'url': hook.url} if hook else None
+        return self.webhooks[guild.id]
+
+    async def get_member(self, guild, discord_id):
+        """Guild member from the gateway cache or our member cache, fetched only on a miss"""
+        member = guild.get_member(discord_id) or self.member_cache.get((guild.id, discord_id))
+        if member is None:
+            try:
+                member = await guild.fetch_member(discord_id)
+            except discord.NotFound:
+                return None
+            self.member_cache.set((guild.id, discord_id), member)
+        return member
 
     async def delete_webhook_message(self, message):
-        hooks = await message.guild.webhooks()
-        hook = next((x for x in hooks if x.name == "Nestr"), None)
+        hook = await self.get_nestr_webhook(message.guild)
         if hook:
-            webhook = Webhook.from_url(hooks[0].url, adapter=RequestsWebhookAdapter())
-            webhook.delete_message(message.id)
+            if self.http_session is None or self.http_session.closed:
+                self.http_session = aiohttp.ClientSession()
+            webhook = Webhook.partial(hook['id'], hook['token'], adapter=AsyncWebhookAdapter(self.http_session))
+            await webhook.delete_message(message.id)
     
     async def get_search_results(self, user, text, limit=100, skip=0, context_id=None):
-        url = f"{nestr_url}/search/{text}?limit={limit}&skip={skip}"
-        if context_id != None:
-            url += "&contextId="+context_id
-        resp = requests.get(url, headers={'X-Auth-Token': user['token'], 'X-User-Id': user['nestr_id']}, verify=True)
-        if (resp.ok):
-            return resp.json().get('data')
-
-        elif (resp.status_code == 401):
-            raise RuntimeError("Invalid login data, please `/login` to Nestr first.")
+        key = (user['nestr_id'], text, context_id, limit, skip)
+        res = self.search_cache.get(key)
+        if res is None:
+            res = await self.nestr.search(user, text, limit=limit, skip=skip, context_id=context_id) or []
+            self.search_cache.set(key, res)
+        return res
+
+    def invalidate_search_cache(self, nestr_id=None, structure=False, broadcast=True):
+        """
+        Drops cached search results that may be stale.
+        :param nestr_id: drop results fetched by, or mentioning, this Nestr user
+        :param structure: drop every circle/role/accountability search
+        :param broadcast: also tell the other workers of a sharded deployment
+        """
+        if broadcast and self.bus is not None:
+            self.bus.publish('search_invalidate', nestr_id=nestr_id, structure=structure)
+        def stale(key):
+            key_user, text = key[0], key[1]
+            if nestr_id and (key_user == nestr_id or nestr_id in text):
+                return True
+            return structure and "circleplus-" in text and "has:completable" not in text
+        removed = self.search_cache.invalidate(stale)
+        self.logger.debug('Invalidated %s cached searches, cache stats: %s', removed, self.search_cache.stats())
+
+    def iter_search_results(self, user, text, page_size=NESTR_PAGE_SIZE, max_items=NESTR_MAX_ITEMS, context_id=None):
+        """
+        Streams search results page by page, prefetching the next page.
+        Use with `async for`; breaking out early stops further requests.
+        """
+        async def fetch_page(limit, skip):
+            return await self.get_search_results(user, text, limit=limit, skip=skip, context_id=context_id)
+        return paginate(fetch_page, page_size, max_items)
     
-    async def sync_workspace(self, ctx, user, category, prefix, workspace_id, workspace_name):
-        # Recursively sync circles and subcircles
-        await self._sync_circle(ctx, user, category, prefix, workspace_id)
-        self.db.storage.flush()
-
-        hooks = await ctx.guild.webhooks()
-        hook = next((x for x in hooks if x.name == "Nestr"), None)
+    @staticmethod
+    def progress_reporter(ctx, text):
+        """
+        Returns an on_progress callback that edits the (deferred) interaction response.
+        """
+        async def on_progress(done, total, eta):
+            eta_text = f", ~{int(eta)}s left" if eta else ""
+            await ctx._http.edit({'content': f"{text} {done}/{total}{eta_text}"}, ctx._token)
+        return on_progress
+
+    async def sync_workspace(self, ctx, user, category, prefix, workspace_id, workspace_name, dry_run=False, on_progress=None):
+        """
+        Reconciles the guild with the workspace: only roles and channels that were
+        added, renamed or deleted on Nestr are touched.
+        :param on_progress: progress callback for the Discord mutations
+        :return: the applied Plan, or the would-be Plan when dry_run
+        """
+        async with self.sync_lock(ctx.guild.id):
+            return await self._sync_workspace(ctx, user, category, prefix, workspace_id, workspace_name,
+                                              dry_run, on_progress)
+
+    async def _sync_workspace(self, ctx, user, category, prefix, workspace_id, workspace_name, dry_run, on_progress):
+        # always read the current workspace structure from Nestr
+        self.invalidate_search_cache(structure=True)
+        tree, pages = await self._fetch_hierarchy(user, workspace_id)
+        plan = plan_workspace(ctx.guild, category, self.db, prefix, workspace_id, tree)
+        self.logger.info('Sync plan for workspace %s on guild %s: %s', workspace_id, ctx.guild.id, plan.summary())
+        if dry_run:
+            return plan
+        await apply_plan(plan, ctx.guild, category, self.db, on_progress)
+        self.models.pop(ctx.guild.id, None)
+
+        hook = await self.get_nestr_webhook(ctx.guild)
         if not hook:
             raise RuntimeError("Webhook not configured on Discord server")
-        webhook_url = quote_plus(hooks[0].url)
-        url = f"{nestr_url}/discordsync/{workspace_id}?webhookUrl={webhook_url}"
-        resp = requests.post(url, headers={'X-Auth-Token': user['token'], 'X-User-Id': user['nestr_id']},  verify=True)
-        if (resp.ok):
+        try:
+            await self.nestr.discord_sync(user, workspace_id, hook['url'])
+        except NestrAuthError:
+            raise
+        except NestrError as err:
+            self.logger.error('discordsync of %s failed: %s', workspace_id, err)
+            raise NestrError("Unable to sync workspace.", err.status) from err
+        else:
             # store synced workspace for this guild
-            Workspace = Query()
-            res = self.db.search((Workspace.workspace_id == workspace_id) & (Workspace.guild_id == ctx.guild.id))
-            if len(res) == 0:
-                self.db.insert({'workspace_id': workspace_id,
-                                'workspace_name': workspace_name,
-                                'prefix': prefix,
-                                'circle_id': workspace_id,
-                                'circle_name': workspace_name,
-                                'discord_name': workspace_name,
-                                'parent_circle': "",
-                                'sync_at': dt.datetime.now().isoformat(),
-                                'guild_id': ctx.guild.id})
-            else:
-                self.db.update({'prefix': prefix,
-                                'workspace_name': workspace_name,
-                                'sync_at': dt.datetime.now().isoformat()},
-                                (Workspace.workspace_id == workspace_id) & (Workspace.guild_id == ctx.guild.id))
-            self.db.storage.flush()
-            return True
-        elif (resp.status_code != 200):
-            print(resp.json())
-            raise RuntimeError("Unable to sync workspace.")
-
-    async def _sync_circle(self, ctx, user, category, prefix, circle_id, depth=2):
-        roles = await self.get_search_results(user, f"label:circleplus-role depth:{depth}", context_id=circle_id)
-        for role in roles:
-            role_name = bs(role.get('title', "No title"), "html.parser").text
-            role_id = role.get('_id') 
-            if prefix:
-                role_name = f"{prefix}/{role_name}"
-            if not get(ctx.guild.roles, name=role_name):
-                await ctx.guild.create_role(name=role_name, mentionable=True)
-                Role = Query()
-                res = self.db.search((Role.role_id == role_id) & (Role.guild_id == ctx.guild.id))
-                if len(res) == 0:
-                    self.db.insert({'role_id': role_id,
-                                    'role_name': bs(role.get('title', "No title"), "html.parser").text,
-                                    'discord_name': role_name,
-                                    'parent_circle': circle_id,
-                                    'sync_at': dt.datetime.now().isoformat(),
-                                    'guild_id': ctx.guild.id})
-                else:
-                    self.db.update({'role_name': bs(role.get('title', "No title"), "html.parser").text,
-                                    'discord_name': role_name,
-                                    'sync_at': dt.datetime.now().isoformat()},
-                                    (Role.role_id == role_id) & (Role.guild_id == ctx.guild.id))
-                self.db.storage.flush()
-            
-        circles = await self.get_search_results(user, f"label:circleplus-circle depth:{depth}", context_id=circle_id)
-        for subcircle in circles:
-            subcircle_id = subcircle.get('_id')
-            if subcircle_id == circle_id:
+            # synced_by's credentials are used by the background re-sync
+            self.db.upsert('workspace', (ctx.guild.id, workspace_id),
+                           {'prefix': prefix,
+                            'workspace_name': workspace_name,
+                            'sync_at': dt.datetime.now().isoformat(),
+                            'synced_by': str(ctx.author.id),
+                            'fingerprint': state_fingerprint(tree, prefix, workspace_id),
+                            'resync_at': self.next_resync_at(),
+                            'sync_cost': pages},
+                           insert_fields={'workspace_id': workspace_id,
+                                          'circle_id': workspace_id,
+                                          'circle_name': workspace_name,
+                                          'discord_name': workspace_name,
+                                          'parent_circle': "",
+                                          'guild_id': ctx.guild.id})
+            self.db.flush()
+            self.models.pop(ctx.guild.id, None)
+            return plan
+
+    async def _search_all(self, user, text, context_id, limiter):
+        """
+        Collects every result of a search. The first page is requested alone, while
+        pages come back full the window doubles up to `sync_concurrency` pages at once.
+        `limiter` bounds the pages in flight across searches.
+        :return: (results, number of pages requested)
+        """
+        async def fetch_page(skip):
+            async with limiter:
+                return await self.get_search_results(user, text, limit=NESTR_PAGE_SIZE, skip=skip, context_id=context_id)
+
+        items = {}
+        skip = 0
+        window = 1
+        requested = 0
+        while True:
+            pages = await asyncio.gather(*(fetch_page(skip + i*NESTR_PAGE_SIZE) for i in range(window)))
+            requested += window
+            for page in pages:
+                for item in page:
+                    items.setdefault(item.get('_id'), item)
+            if any(len(page) < NESTR_PAGE_SIZE for page in pages):
+                return list(items.values()), requested
+            skip += window*NESTR_PAGE_SIZE
+            window = min(window * 2, sync_concurrency)
+
+    async def _fetch_hierarchy(self, user, workspace_id):
+        """
+        Loads all roles, circles and accountabilities below the anchor circle with
+        bulk paged searches and rebuilds the tree locally from their parentId.
+        Each role gets its accountability texts under 'accountabilities'.
+        :return: ((roles, [(subcircle, subtree), ...]) in Nestr result order, number of pages requested)
+        """
+        limiter = asyncio.Semaphore(sync_concurrency)
+        (roles, role_pages), (circles, circle_pages), (accs, acc_pages) = await asyncio.gather(
+            self._search_all(user, "label:circleplus-role", workspace_id, limiter),
+            self._search_all(user, "label:circleplus-circle", workspace_id, limiter),
+            self._search_all(user, "label:circleplus-accountability", workspace_id, limiter))
+        accs_by_role = {}
+        for acc in accs:
+            accs_by_role.setdefault(acc.get("parentId"), []).append(html_to_text(acc.get('title')))
+        roles = [{**role, 'accountabilities': accs_by_role.get(role.get('_id'), [])} for role in roles]
+        self.logger.info('Loaded %s roles, %s circles and %s accountabilities of workspace %s',
+                         len(roles), len(circles), len(accs), workspace_id)
+        return build_tree(workspace_id, roles, circles), role_pages + circle_pages + acc_pages
+
+    def sync_lock(self, guild_id):
+        if guild_id not in self.sync_locks:
+            self.sync_locks[guild_id] = asyncio.Lock()
+        return self.sync_locks[guild_id]
+
+    @staticmethod
+    def next_resync_at(spread=False):
+        """
+        Due time of a workspace's next background re-sync, jittered so guilds synced
+        together drift apart. With `spread` it falls anywhere within one interval.
+        """
+        low, high = (0, 1) if spread else (1 - resync_jitter, 1 + resync_jitter)
+        delay = resync_interval * random.uniform(low, high)
+        return (dt.datetime.now() + dt.timedelta(seconds=delay)).isoformat()
+
+    async def resync_workspace(self, guild, record, max_mutations):
+        """
+        Background re-sync of one workspace with the credentials of the admin who synced it.
+        Workspaces whose Nestr structure is unchanged since the last sync are left alone.
+        Plans with more than `max_mutations` mutations are applied in parts on later ticks.
+        :return: (Nestr search pages requested, Discord mutations applied)
+        """
+        workspace_id = record['workspace_id']
+        prefix = record.get('prefix')
+        user = self.get_loggedin_user(record['synced_by']) if record.get('synced_by') else None
+        category = get(guild.categories, name=f"{record.get('workspace_name')} circles")
+        if user is None or category is None:
+            self.logger.info('Not re-syncing workspace %s on guild %s: %s', workspace_id, guild.id,
+                             "no stored credentials" if user is None else "category was removed")
+            self.db.update({'resync_at': self.next_resync_at()}, [record])
+            return 0, 0
+
+        self.invalidate_search_cache(structure=True)
+        tree, pages = await self._fetch_hierarchy(user, workspace_id)
+        fields = {'resync_at': self.next_resync_at(), 'sync_cost': pages}
+        fingerprint = state_fingerprint(tree, prefix, workspace_id)
+        if fingerprint == record.get('fingerprint'):
+            self.db.update(fields, [record])
+            return pages, 0
+
+        plan = plan_workspace(guild, category, self.db, prefix, workspace_id, tree)
+        partial = plan.limited(max_mutations)
+        await apply_plan(partial, guild, category, self.db)
+        self.models.pop(guild.id, None)
+        applied = len(partial.mutations)
+        if applied < len(plan.mutations):
+            # the rest is planned again on the next tick
+            fields['resync_at'] = dt.datetime.now().isoformat()
+        else:
+            fields.update(fingerprint=fingerprint, sync_at=dt.datetime.now().isoformat())
+        self.db.update(fields, [record])
+        self.logger.info('Re-synced workspace %s on guild %s: %s applied of %s', workspace_id, guild.id,
+                         applied, plan.summary())
+        return pages, applied
+
+    @tasks.loop(seconds=resync_tick)
+    async def resync_loop(self):
+        # an exception escaping a tick would stop the loop until the next restart
+        try:
+            await self.resync_due()
+        except Exception:
+            self.logger.exception('Background re-sync tick failed')
+
+    async def resync_due(self):
+        """Re-syncs the due workspaces, most overdue first, within the per tick budgets"""
+        now = dt.datetime.now()
+        due = []
+        for guild in self.bot.guilds:
+            for record in self.db.workspaces(guild.id):
+                if not record.get('resync_at'):
+                    # synced before background re-syncs existed
+                    self.db.update({'resync_at': self.next_resync_at(spread=True)}, [record])
+                elif dt.datetime.fromisoformat(record['resync_at']) <= now:
+                    due.append((record['resync_at'], guild, record))
+
+        nestr_budget = resync_nestr_budget
+        discord_budget = resync_discord_budget
+        for resync_at, guild, record in sorted(due, key=lambda item: item[0]):
+            # a workspace bigger than the whole budget still gets a tick of its own
+            cost = record.get('sync_cost', 3 * sync_concurrency)
+            if discord_budget <= 0 or (cost > nestr_budget and nestr_budget < resync_nestr_budget):
+                break
+            lock = self.sync_lock(guild.id)
+            if lock.locked():
                 continue
-            subcircle_name = bs(subcircle.get('title', "No title"), "html.parser").text.lower()
-            subcircle_name = re.sub('\.', '', subcircle_name)
-            subcircle_name = re.sub('\s', '-', subcircle_name)
-            if prefix:
-                subcircle_name = f"{prefix}-{subcircle_name}"
-
-            if not get(category.channels, name=subcircle_name+"-circle"):
-                purpose = bs(subcircle.get('purpose', ""), "html.parser").text
-                await ctx.guild.create_text_channel(name=subcircle_name+"-circle", category=category, topic=purpose)
-                # create circle in database
-                Circle = Query()
-                res = self.db.search((Circle.circle_id == subcircle_id) & (Circle.guild_id == ctx.guild.id))
-                if len(res) == 0:
-                    self.db.insert({'circle_id': subcircle_id,
-                                    'circle_name': bs(subcircle.get('title', "No title"), "html.parser").text,
-                                    'discord_name': subcircle_name,
-                                    'parent_circle': circle_id,
-                                    'updated_at': dt.datetime.now().isoformat(),
-                                    'guild_id': ctx.guild.id})
-                else:
-                    self.db.update({'circle_name': bs(subcircle.get('title', "No title"), "html.parser").text,
-                                    'discord_name': subcircle_name,
-                                    'parent_circle': circle_id,
-                                    'updated_at': dt.datetime.now().isoformat()},
-                                    (Circle.circle_id == subcircle_id) & (Circle.guild_id == ctx.guild.id))
-                self.db.storage.flush()
-            
-            # TODO: remove deleted circles and roles???
+            async with lock:
+                # /unsync may have removed the workspace while an earlier one was re-synced
+                current = self.db.workspace(guild.id, record['workspace_id'])
+                if not current:
+                    continue
+                record = current[0]
+                try:
+                    pages, mutations = await self.resync_workspace(guild, record, discord_budget)
+                except Exception:
+                    self.logger.exception('Re-sync of workspace %s on guild %s failed', record.get('workspace_id'), guild.id)
+                    self.db.update({'resync_at': self.next_resync_at()}, [record])
+                    continue
+            nestr_budget -= pages
+            discord_budget -= mutations
+        self.db.flush()
 
-            # Recursively sync subcircles
-            await self._sync_circle(ctx, user, category, subcircle_name, subcircle_id, depth+1)
-    
-    async def unsync_workspace(self, ctx, user, workspace_id):
-        Workspace = Query()
-        ws = self.db.search((Workspace.workspace_id == workspace_id) & (Workspace.guild_id == ctx.guild.id))
+    @tasks.loop(seconds=SHARD_BUS_INTERVAL)
+    async def bus_loop(self):
+        self.bus.poll()
+
+    @resync_loop.before_loop
+    async def before_resync_loop(self):
+        await self.bot.wait_until_ready()
+
+    async def unsync_workspace(self, ctx, user, workspace_id, on_progress=None):
+        # never runs alongside a (background re-)sync of the same guild
+        async with self.sync_lock(ctx.guild.id):
+            return await self._unsync_workspace(ctx, user, workspace_id, on_progress)
+
+    async def _unsync_workspace(self, ctx, user, workspace_id, on_progress):
+        ws = self.db.workspace(ctx.guild.id, workspace_id)
         if len(ws) > 0:
-            await self._unsync_circles(ctx, user, workspace_id)
-            self.db.remove((Workspace.workspace_id == workspace_id) & (Workspace.guild_id == ctx.guild.id))
-            self.db.storage.flush()
+            plan = plan_unsync(ctx.guild, self.db, workspace_id)
+            await apply_plan(plan, ctx.guild, None, self.db, on_progress)
+            self.models.pop(ctx.guild.id, None)
+            self.db.remove(ws)
+            self.db.flush()
 
             # TODO: tell Nestr to unsync this workspace
             # url = f"{nestr_url}/discordunsync/{workspace_id}"
@@ -193,80 +460,67 @@ class NestrCog(commands.Cog, name='Nestr functions'):
         else:
             raise RuntimeError("Workspace not found.")
 
-    # Recursive remove circles
-    # NOTE: remember to self.db.storage.flush() later
-    async def _unsync_circles(self, ctx, user, circle_id):
-        Role = Query()
-        roles = self.db.search((Role.parent_circle == circle_id) & (Role.guild_id == ctx.guild.id))
-        if len(roles) > 0:
-            for role in roles:
-                role_name = role.get('discord_name',"")
-                if get(ctx.guild.roles, name=role_name):
-                    await get(ctx.guild.roles, name=role_name).delete()
-                    self.db.remove((Role.role_id == role.get('role_id')) & (Role.guild_id == ctx.guild.id))
-
-        Circle = Query()
-        circles = self.db.search((Circle.parent_circle == circle_id) & (Circle.guild_id == ctx.guild.id))
-        if len(circles) > 0:
-            for circle in circles:
-                circle_name = circle.get('discord_name',"")
-                if get(ctx.guild.channels, name=circle_name+"-circle"):
-                    await get(ctx.guild.channels, name=circle_name+"-circle").delete()
-                    self.db.remove((Circle.circle_id == circle.get('circle_id')) & (Circle.guild_id == ctx.guild.id))
-
-                # Recursively unsync subcircles
-                await self._unsync_circles(ctx, user, circle.get('circle_id'))
-
-      
-        
     #### webhook listeners ####
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # warm the webhook cache, guilds without permission resolve lazily later
+        async def resolve(guild):
+            try:
+                await self.get_nestr_webhook(guild)
+            except discord.HTTPException as err:
+                self.logger.warning('Unable to resolve webhooks of guild %s: %s', guild.id, err)
+        await asyncio.gather(*(resolve(guild) for guild in self.bot.guilds if guild.id not in self.webhooks))
+
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel):
+        self.webhooks.pop(channel.guild.id, None)
+
     @commands.Cog.listener()
     async def on_message(self, message):
+        """Parses webhook messages and queues them, the work happens in handle_webhook_job"""
         # messages like: !webhook-login|123123123123|Chn6AGBTysKCnXESc|Chn6AGBTysKCnXEScChn6AGBTysKCnXESc
         if message.content.startswith("!webhook-login"):
             parts = message.content.split("|")
             if len(parts) == 4:
-                discord_id = parts[1]
-                nestr_id = parts[2]
-                token = parts[3]
-                
-                # store or update userid and token
-                User = Query()
-                res = self.db.search(User.discord_id == discord_id)
-                if len(res) > 0:
-                    self.db.update({'discord_id': discord_id, 'nestr_id': nestr_id, 'token': token}, User.discord_id == discord_id)
-                else:
-                    self.db.insert({'discord_id': discord_id, 'nestr_id': nestr_id, 'token': token})
-                self.db.storage.flush()
-                
-                # delete the received message
-                await self.delete_webhook_message(message)
+                job = {'type': 'login',
+                       'discord_id': parts[1],
+                       'nestr_id': parts[2],
+                       'token': parts[3],
+                       'message': message}
+                await self.ingest.submit(job['discord_id'], job)
 
         # messages like: !webhook-notification|123123123123123|Title|Content
         if message.content.startswith("!webhook-notification"):
             parts = message.content.split("|")
             if len(parts) >= 4:
-                discord_id = int(parts[1])
-                title = parts[2]
-                content = parts[3] or "No extra details"
-                url = ""
-                if len(parts) == 5:
-                    url = parts[4] 
-                
-                # send pm to user
-                user = await message.channel.guild.fetch_member(discord_id)
-                if user:
-                    embed = discord.Embed(
-                        title="Nestr Notification",
-                        description=title,
-                        color=0x4A44EE,
-                        url=url, 
-                    )
-                    embed.add_field(name="Contents", value=content)
-                    await user.send(embed=embed)
-
-                # delete the received message
-                await self.delete_webhook_message(message)
+                job = {'type': 'notification',
+                       'discord_id': int(parts[1]),
+                       'title': parts[2],
+                       'content': parts[3] or "No extra details",
+                       'url': parts[4] if len(parts) == 5 else "",
+                       'message': message}
+                await self.ingest.submit(str(job['discord_id']), job)
+
+    async def handle_webhook_job(self, job):
+        message = job['message']
+        if job['type'] == 'login':
+            # store or update userid and token
+            discord_id = job['discord_id']
+            self.db.upsert('discord_id', discord_id, {'discord_id': discord_id, 'nestr_id': job['nestr_id'], 'token': job['token']})
+            self.db.flush(durable=True)
+
+        elif job['type'] == 'notification':
+            discord_id = job['discord_id']
+            # the notification means this user's Nestr data changed
+            db_user = self.get_loggedin_user(discord_id)
+            if db_user:
+                self.invalidate_search_cache(nestr_id=db_user['nestr_id'])
+
+            # send pm to user, coalesced with other notifications arriving for them
+            await self.notifier.notify(message.channel.guild, discord_id, job['title'], job['content'], job['url'])
+
+        # delete the received message
+        await self.delete_webhook_message(message)
 
     ##### /sync command ####
     @cog_ext.cog_slash(name="sync",
@@ -277,9 +531,14 @@ class NestrCog(commands.Cog, name='Nestr functions'):
                               description="Workspace prefix",
                               option_type=SlashCommandOptionType.STRING,
                               required=False),
+                          create_option(
+                              name="dry_run",
+                              description="Only show what would change",
+                              option_type=SlashCommandOptionType.BOOLEAN,
+                              required=False),
                       ])
     @commands.has_any_role("admin")
-    async def sync(self, ctx: SlashContext, prefix: str=None):
+    async def sync(self, ctx: SlashContext, prefix: str=None, dry_run: bool=False):
         """Syncs Nestr workspaces to Discord"""
 
         ts = dt.datetime.now().strftime('%d-%b-%y %H:%M:%S')
@@ -290,30 +549,43 @@ class NestrCog(commands.Cog, name='Nestr functions'):
             await ctx.send("Please /login to Nestr first.", hidden=True)
             return
         try:
-            workspaces = await self.get_search_results(user, "label:circleplus-anchor-circle", limit=5)
             action_rows = []
             added = {}
-            while (len(workspaces)): 
-                buttons = []
-                for ws in workspaces:
-                    b = create_button(
-                        style=ButtonStyle.blue,
-                        label=bs(ws.get('title', "No title"), "html.parser").text,
-                        custom_id=ws.get("_id"),
-                        disabled = False
-                    )
-                    buttons.append(b)
-                    added[ws.get("_id")] = ws.get("title", "No title")
+            buttons = []
+            # Discord allows 5 action rows of 5 buttons per message
+            async for ws in self.iter_search_results(user, "label:circleplus-anchor-circle", page_size=5, max_items=25):
+                b = create_button(
+                    style=ButtonStyle.blue,
+                    label=html_to_text(ws.get('title', "No title")),
+                    custom_id=ws.get("_id"),
+                    disabled = False
+                )
+                buttons.append(b)
+                added[ws.get("_id")] = ws.get("title", "No title")
+                if len(buttons) == 5:
+                    action_rows.append(create_actionrow(*buttons))
+                    buttons = []
+            if buttons:
                 action_rows.append(create_actionrow(*buttons))
-                workspaces = await self.get_search_results(user, "label:circleplus-anchor-circle", limit=5, skip=len(added))
+            if len(action_rows) == 0:
+                await ctx.send("No workspaces found.", hidden=True)
+                return
             await ctx.send("Choose workspace to sync to Discord", components=action_rows, hidden=True)
             button_ctx = await wait_for_component(self.bot, components=action_rows, timeout=120)
             selected_id = button_ctx.component_id
             selected_name = added[button_ctx.component_id]
             category_name = f"{selected_name} circles"
+            # syncing takes longer than the 3s interaction deadline
+            await button_ctx.defer(edit_origin=True)
 
             # add one channel per circle + one for anchor
             category = get(ctx.guild.categories, name=category_name)
+            if dry_run:
+                plan = await self.sync_workspace(ctx, user, category, prefix, workspace_id=selected_id,
+                                                 workspace_name=selected_name, dry_run=True)
+                await button_ctx.edit_origin(content=f"Sync plan for `{selected_name}` ({plan.summary()}):\n{plan.describe()}",
+                                             components=[])
+                return
             if not category:
                 category = await ctx.guild.create_category(category_name, overwrites=None, reason=None)
             
@@ -321,9 +593,10 @@ class NestrCog(commands.Cog, name='Nestr functions'):
                 await ctx.guild.create_text_channel("anchor-circle", category=category)
             
             # TODO: map people already bound to Discord to their roles??
-            await self.sync_workspace(ctx, user, category, prefix, workspace_id=selected_id, workspace_name=selected_name)
+            plan = await self.sync_workspace(ctx, user, category, prefix, workspace_id=selected_id, workspace_name=selected_name,
+                                             on_progress=self.progress_reporter(button_ctx, f"Syncing `{selected_name}`:"))
             
-            await button_ctx.edit_origin(content=f"Worspace `{selected_name}` enabled!")
+            await button_ctx.edit_origin(content=f"Worspace `{selected_name}` enabled! ({plan.summary()})")
             return
         except Exception as err:
             await ctx.send("{0}".format(err), hidden=True)
@@ -344,8 +617,7 @@ class NestrCog(commands.Cog, name='Nestr functions'):
             await ctx.send("Please /login to Nestr first.", hidden=True)
             return
         try:
-            Workspace = Query()
-            workspaces = self.db.search((Workspace.guild_id == ctx.guild.id) & Workspace.workspace_name.exists())
+            workspaces = self.db.workspaces(ctx.guild.id)
             if len(workspaces) == 0:
                 await ctx.send("No workspaces enabled.", hidden=True)
                 return
@@ -369,8 +641,10 @@ class NestrCog(commands.Cog, name='Nestr functions'):
             selected_id = button_ctx.component_id
             selected_name = added[button_ctx.component_id]
             category_name = f"{selected_name} circles"
+            await button_ctx.defer(edit_origin=True)
 
-            await self.unsync_workspace(ctx, user, workspace_id=selected_id)
+            await self.unsync_workspace(ctx, user, workspace_id=selected_id,
+                                        on_progress=self.progress_reporter(button_ctx, f"Disabling `{selected_name}`:"))
 
             category = get(ctx.guild.categories, name=category_name)
             if category:
@@ -401,10 +675,6 @@ class NestrCog(commands.Cog, name='Nestr functions'):
     async def inbox(self, ctx: SlashContext, text: str):
         """Nestr inbox"""
 
-        nest_data = {
-            "parentId": "inbox",
-            "title": text,
-        }
         ts = dt.datetime.now().strftime('%d-%b-%y %H:%M:%S')
         
         # check if user logged in
@@ -413,14 +683,13 @@ class NestrCog(commands.Cog, name='Nestr functions'):
             await ctx.send("Please /login to Nestr first.", hidden=True)
             return
         
-        url = nestr_url + "/n/inbox"
         # call Nestr API to create inbox
-        resp = requests.post(url, headers={'X-Auth-Token': user['token'], 'X-User-Id': user['nestr_id']}, verify=True, data=nest_data)
-        if (resp.ok):
+        try:
+            resp = await self.nestr.create_inbox(user, text)
+            self.invalidate_search_cache(nestr_id=user['nestr_id'])
             self.logger.info(f"{ts}: posted {resp}\n")
-            #rint (resp.json())
-        elif (resp.status_code == 401):
-            await ctx.send("Invalid login data, please `/login` to Nestr first.", hidden=True)
+        except NestrError as err:
+            await ctx.send("{0}".format(err), hidden=True)
             return
         
         self.logger.info(f"{ts}: {ctx.author} executed '/inbox'\n")
@@ -438,9 +707,9 @@ class NestrCog(commands.Cog, name='Nestr functions'):
         if not ctx.guild:
             await ctx.send("You must login from an existing guild that has the bot configured.", hidden=True)
             return
-        hooks = await ctx.guild.webhooks()
-        if len(hooks) > 0:
-            url = nestr_url + "/authenticate?bot_callback="+hooks[0].url+"&discord_id=" + str(ctx.author.id)
+        hook = await self.get_nestr_webhook(ctx.guild)
+        if hook:
+            url = nestr_url + "/authenticate?bot_callback="+hook['url']+"&discord_id=" + str(ctx.author.id)
             await ctx.send("Please login clicking on [this link]("+url+").", hidden=True)
         else:
             await ctx.send("[ERROR] Webhook not configured!", hidden=True)
@@ -455,8 +724,13 @@ class NestrCog(commands.Cog, name='Nestr functions'):
                               description="Search accountability text",
                               option_type=SlashCommandOptionType.STRING,
                               required=True),
+                          create_option(
+                              name="live",
+                              description="Search Nestr directly instead of the synced accountabilities",
+                              option_type=SlashCommandOptionType.BOOLEAN,
+                              required=False),
                         ])
-    async def accountable(self, ctx: SlashContext, search: str):
+    async def accountable(self, ctx: SlashContext, search: str, live: bool=False):
         """Search roles accountable"""
 
         ts = dt.datetime.now().strftime('%d-%b-%y %H:%M:%S')
@@ -467,45 +741,44 @@ class NestrCog(commands.Cog, name='Nestr functions'):
             await ctx.send("Please /login to Nestr first.", hidden=True)
             return
         try:
-            valid_roles = self.get_synced_roles(ctx)
-            synced_circles = {circle.get("circle_id"): circle for circle in self.get_synced_circles(ctx)}
-            text = search
+            model = self.get_workspace_model(ctx.guild.id)
             search_text = "label:circleplus-accountability "+search
-            accs = await self.get_search_results(user, search_text, 100)
-            accs_sorted = sorted(accs, key=lambda acc: acc.get("parentId"))
-            keys = [key for key,group in groupby(accs_sorted, key=lambda acc: acc.get("parentId"))]
-            res = [role for role in valid_roles if role.get("role_id") in keys]
-            res_sorted = sorted(res, key=lambda res: res.get("parent_circle"))
-            grouped_roles = {}
-            for k,g in groupby(res_sorted, key=lambda res: res.get("parent_circle")):
-                grouped_roles[k] = list(g)
-
-            embed = discord.Embed(
-                title="Accountable roles",
-                color=0x4A44EE,
-                description=f"Roles accountable for `{search}` (top 25 items)",
-                url=nestr_base_url+quote("/search/"+search_text),
-            )
-            for circle_id in grouped_roles.keys():
-                if circle_id not in synced_circles.keys():
-                    continue
-                circle = synced_circles[circle_id]
-                circle_title = circle.get("circle_name")
-                circle_link = nestr_base_url+"/n/"+circle_id
-                embed.add_field(name=f"🔵 Circle", value=f"[{circle_title}]({circle_link})", inline=False)
-                for role in grouped_roles[circle_id]:
-                    title = role.get('role_name')[:100]
-                    link = nestr_base_url+"/n/"+role.get('role_id')
-                    role_text = ""
-                    for acc in accs:
-                        if acc.get("parentId") == role.get("role_id"):
-                            acc_title = bs(acc.get('title'), "html.parser").text
-                            role_text += f"> - {acc_title}\n"
-                    embed.add_field(name=f"> 🎭 {title} - {link}", value=f"{role_text}", inline=False)
-            if len(grouped_roles) == 0:
-                    embed.add_field(name=f"No results found", value="...", inline=False)
-            
-            await ctx.send(embed=embed)
+            index = model.accountabilities
+
+            async def indexed_fields():
+                # role_id -> matching accountabilities, grouped by circle in one pass
+                by_circle = {}
+                for role_id, role_accs in index.search(search).items():
+                    role = model.roles.get(role_id)
+                    if role is not None and role.parent is not None:
+                        by_circle.setdefault(role.parent, []).append((role, role_accs))
+                for circle, circle_roles in by_circle.items():
+                    yield "🔵 Circle", f"[{circle.name}]({nestr_base_url}/n/{circle.id})"
+                    for role, role_accs in circle_roles:
+                        link = nestr_base_url+"/n/"+role.id
+                        yield f"> 🎭 {role.name[:100]} - {link}", "".join(f"> - {acc}\n" for acc in role_accs)
+
+            async def live_fields():
+                accs = self.iter_search_results(user, search_text)
+                by_circle = {}
+                async for role_id, role_accs in grouped(accs, key=lambda acc: acc.get("parentId")):
+                    role = model.roles.get(role_id)
+                    if role is not None and role.parent is not None:
+                        by_circle.setdefault(role.parent, []).append((role, role_accs))
+                for circle, circle_roles in by_circle.items():
+                    yield "🔵 Circle", f"[{circle.name}]({nestr_base_url}/n/{circle.id})"
+                    for role, role_accs in circle_roles:
+                        link = nestr_base_url+"/n/"+role.id
+                        role_text = "".join(f"> - {html_to_text(acc.get('title'))}\n" for acc in role_accs)
+                        yield f"> 🎭 {role.name[:100]} - {link}", role_text
+
+            # workspaces synced before accountabilities were indexed fall back to Nestr
+            fields = live_fields if live or len(index) == 0 else indexed_fields
+            paginator = EmbedPaginator(fields(),
+                                       title="Accountable roles",
+                                       description=f"Roles accountable for `{search}`",
+                                       url=nestr_base_url+quote("/search/"+search_text))
+            await paginator.send(ctx, self.bot)
         except Exception as err:
             await ctx.send("{0}".format(err), hidden=True)
             raise
@@ -532,61 +805,42 @@ class NestrCog(commands.Cog, name='Nestr functions'):
             await ctx.send("Please /login to Nestr first.", hidden=True)
             return
         try:
-            valid_roles = [role.get("role_id") for role in self.get_synced_roles(ctx)]
-            synced_circles = {circle.get("circle_id"): circle for circle in self.get_synced_circles(ctx)}
-            res = []
+            model = self.get_workspace_model(ctx.guild.id)
             mention = ""
             if who:
                 db_user = self.get_loggedin_user(who.id)
                 if not db_user:
                     await ctx.send("That user never logged in to Nestr.", hidden=True)
                     return
-                text = who.name
                 mention = f"{who.mention}"
                 search_text = "label:circleplus-role assignee:"+db_user['nestr_id']
-                res = await self.get_search_results(user, search_text, 100)
-                res = [role for role in res if role.get("_id") in valid_roles]
-
             else:
-                text = "me"
                 mention = f"{ctx.author.mention}"
                 search_text = "label:circleplus-role assignee:me"
-                res = await self.get_search_results(user, search_text, 100)
-                res = [role for role in res if role.get("_id") in valid_roles]
-            count = len(res)
-
-            res_sorted = sorted(res, key=lambda res: res.get("parentId"))
-            grouped_roles = {}
-            for k,g in groupby(res_sorted, key=lambda res: res.get("parentId")):
-                grouped_roles[k] = list(g)
-
-            embed = discord.Embed(
-                title="Roles",
-                color=0x4A44EE,
-                description=f"Roles for {mention} (showing top 25)",
-                url=nestr_base_url+quote("/search/"+search_text),
-            )
-            for circle_id in grouped_roles.keys():
-                if circle_id not in synced_circles.keys():
-                    continue
-                circle = synced_circles[circle_id]
-                circle_title = circle.get("circle_name")
-                circle_link = nestr_base_url+"/n/"+circle_id
-                embed.add_field(name=f"🔵 Circle", value=f"[{circle_title}]({circle_link})", inline=False)
-                for role in grouped_roles[circle_id]:
-                    title = bs(role.get('title', "No title")[:100], "html.parser").text
-                    purpose = bs(role.get('purpose', "No title")[:200], "html.parser").text
-                    link = nestr_base_url+"/n/"+role.get('_id')
-                    embed.add_field(name=f"> 🎭 {title} - {link}", value=f"> {purpose}", inline=False)
-                    # \n> >[link]({link})
-                if len(grouped_roles) == 0:
-                    embed.add_field(name=f"No roles found", value="...", inline=False)
-
-            await ctx.send(embed=embed)
+            res = (role async for role in self.iter_search_results(user, search_text) if role.get("_id") in model.roles)
+
+            async def fields():
+                async for circle_id, circle_roles in grouped(res, key=lambda role: role.get("parentId")):
+                    circle = model.circles.get(circle_id)
+                    if circle is None:
+                        continue
+                    yield "🔵 Circle", f"[{circle.name}]({nestr_base_url}/n/{circle_id})"
+                    for role in circle_roles:
+                        title = html_to_text(role.get('title', "No title")[:100])
+                        purpose = html_to_text(role.get('purpose', "No title")[:200])
+                        link = nestr_base_url+"/n/"+role.get('_id')
+                        yield f"> 🎭 {title} - {link}", f"> {purpose}"
+
+            paginator = EmbedPaginator(fields(),
+                                       title="Roles",
+                                       description=f"Roles for {mention}",
+                                       url=nestr_base_url+quote("/search/"+search_text),
+                                       empty=("No roles found", "..."))
+            self.logger.info(f"{ts}: {ctx.author} executed '/roles'\n")
+            await paginator.send(ctx, self.bot)
         except Exception as err:
             await ctx.send("{0}".format(err), hidden=True)
             raise
-        self.logger.info(f"{ts}: {ctx.author} executed '/roles'\n")
 
     ##### /todos command ####
     @cog_ext.cog_slash(name="todos",
@@ -614,20 +868,18 @@ class NestrCog(commands.Cog, name='Nestr functions'):
             await ctx.send("Please /login to Nestr first.", hidden=True)
             return
         try:
-            valid_role_ids = [role.get("role_id") for role in self.get_synced_roles(ctx)]
-            valid_circle_ids = [circle.get("circle_id") for circle in self.get_synced_circles(ctx)]
-            res = []
+            model = self.get_workspace_model(ctx.guild.id)
             mention = ""
+            context_id = None
             if role:
                 mention = f"{role.mention}"
                 search_text = "label:!project has:completable"
-                clean_role_name = bs(role.name, "html.parser").text
-                db_roles = [r for r in self.get_synced_roles(ctx) if r.get("discord_name") == clean_role_name]
-                if len(db_roles) == 0:
+                clean_role_name = html_to_text(role.name)
+                db_role = model.role_by_discord_name(clean_role_name)
+                if db_role is None:
                     await ctx.send(f"Role {role.name} not present on Nestr.", hidden=True)
                     return
-                db_role = db_roles[0]
-                res = await self.get_search_results(user, search_text, 100, context_id=db_role.get("role_id"))
+                context_id = db_role.id
             elif who:
                 db_user = self.get_loggedin_user(who.id)
                 if not db_user:
@@ -635,73 +887,34 @@ class NestrCog(commands.Cog, name='Nestr functions'):
                     return
                 mention = f"{who.mention}"
                 search_text = "label:!project has:completable parent-labels:circleplus-role,circleplus-circle,circleplus-anchor-circle assignee:"+db_user['nestr_id']
-                res = await self.get_search_results(user, search_text, 200)
-
             else:
                 mention = f"{ctx.author.mention}"
                 search_text = "label:!project has:completable parent-labels:circleplus-role,circleplus-circle,circleplus-anchor-circle assignee:"+user['nestr_id']
-                res = await self.get_search_results(user, search_text, 200)
-                
-
-            res = [todo for todo in res if todo.get("parentId") in valid_role_ids or todo.get("parentId") in valid_circle_ids]
-            res_sorted = sorted(res, key=lambda res: res.get("parentId"))
-            grouped_todos = {}
-            for k,g in groupby(res_sorted, key=lambda res: res.get("parentId")):
-                grouped_todos[k] = list(g)
-
-            embed = discord.Embed(
-                title="Todos",
-                color=0x4A44EE,
-                description=f"Todos for {mention} (page 1)",
-                url=nestr_base_url+quote("/search/"+search_text),
-            )
-            synced_roles = {role.get("role_id"):role for role in self.get_synced_roles(ctx)}
-            synced_circles = {circle.get("circle_id"):circle for circle in self.get_synced_circles(ctx)}
-            item_count=0
-            page=1
-            for parent_id in grouped_todos.keys():
-                if parent_id in valid_circle_ids:
-                    circle = synced_circles[parent_id]
-                    circle_title = circle.get("circle_name")
-                    circle_link = nestr_base_url+"/n/"+parent_id
-                    embed.add_field(name=f"🔵 Circle", value=f"[{circle_title}]({circle_link})", inline=False)
-                    for todo in grouped_todos[parent_id]:
-                        title = bs(todo.get('title', "No title")[:200], "html.parser").text
-                        link = nestr_base_url+"/n/"+todo.get('_id')
-                        embed.add_field(name=f"> 📃 {title}", value=f"> 🔗 [link]({link})", inline=False)
-                        item_count+=1
-                elif parent_id in valid_role_ids:
-                    role = synced_roles[parent_id]
-                    role_id = role.get("role_id")
-                    role_title = role.get("role_name")
-                    role_link = nestr_base_url+"/n/"+parent_id
-                    embed.add_field(name=f"  🎭Role", value=f"[{role_title}]({role_link})", inline=False)
-                    for todo in grouped_todos[role_id]:
-                        title = bs(todo.get('title', "No title")[:200], "html.parser").text
+            res = self.iter_search_results(user, search_text, context_id=context_id)
+
+            async def fields():
+                async for parent_id, todos in grouped(res, key=lambda todo: todo.get("parentId")):
+                    if parent_id in model.circles:
+                        yield "🔵 Circle", f"[{model.circles[parent_id].name}]({nestr_base_url}/n/{parent_id})"
+                    elif parent_id in model.roles:
+                        yield "  🎭Role", f"[{model.roles[parent_id].name}]({nestr_base_url}/n/{parent_id})"
+                    else:
+                        continue
+                    for todo in todos:
+                        title = html_to_text(todo.get('title', "No title")[:200])
                         link = nestr_base_url+"/n/"+todo.get('_id')
-                        embed.add_field(name=f"> 📃 {title}", value=f"> 🔗 [link]({link})", inline=False)
-                        item_count+=1
-                    
-                if item_count > 20:
-                    await ctx.send(embed=embed)
-                    page+=1
-                    item_count=0
-                    embed = discord.Embed(
-                        title="Todos",
-                        color=0x4A44EE,
-                        description=f"Todos for {mention} (page {page})",
-                        url=nestr_base_url+quote("/search/"+search_text),
-                    )
-
-                    
-                if len(grouped_todos) == 0:
-                    embed.add_field(name=f"No todos found", value="...", inline=False)
-
-            await ctx.send(embed=embed)
+                        yield f"> 📃 {title}", f"> 🔗 [link]({link})"
+
+            paginator = EmbedPaginator(fields(),
+                                       title="Todos",
+                                       description=f"Todos for {mention}",
+                                       url=nestr_base_url+quote("/search/"+search_text),
+                                       empty=("No todos found", "..."))
+            self.logger.info(f"{ts}: {ctx.author} executed '/todos'\n")
+            await paginator.send(ctx, self.bot)
         except Exception as err:
             await ctx.send("{0}".format(err), hidden=True)
             raise
-        self.logger.info(f"{ts}: {ctx.author} executed '/todos'\n")
 
 
 def setup(bot):
@@ -0,0 +1,135 @@
+"""
+This module runs the bot sharded over several worker processes.
+
+Each worker runs server.py as an AutoShardedBot owning a contiguous range of
+Discord shards. All workers share the SQLite database, so the launcher refuses
+the JSON backend. Crashed workers are restarted with a growing delay.
+
+Usage: python3 launcher.py [--workers N] [--shards M]
+"""
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging.config
+import argparse
+import subprocess
+import discord
+from dotenv import load_dotenv, find_dotenv
+from utils.sharding import shard_ranges
+
+load_dotenv(find_dotenv())
+TOKEN = os.getenv('DISCORD_TOKEN')
+
+logging.config.fileConfig("logs.ini", disable_existing_loggers=False)
+logger = logging.getLogger('server.launcher')
+
+# Discord allows one IDENTIFY per 5 seconds, workers are started that far apart per shard
+IDENTIFY_INTERVAL = 5.5
+
+
+async def recommended_shards():
+    """Shard count Discord recommends for the bot"""
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(TOKEN, bot=True)
+        shards, _ = await http.get_bot_gateway()
+        return shards
+    finally:
+        await http.close()
+
+
+def worker_env(index, shard_ids, shard_count):
+    env = dict(os.environ)
+    env.update(SHARD_COUNT=str(shard_count),
+               SHARD_IDS=",".join(str(shard_id) for shard_id in shard_ids),
+               WORKER_INDEX=str(index))
+    env.setdefault('DB_BACKEND', 'sqlite')
+    env['SNAPSHOT_PATH'] = f"{os.getenv('SNAPSHOT_PATH', '/app/warm_state.json')}.worker{index}"
+    if os.getenv('METRICS_PORT'):
+        env['METRICS_PORT'] = str(int(os.getenv('METRICS_PORT')) + index)
+    if os.getenv('METRICS_PATH'):
+        env['METRICS_PATH'] = f"{os.getenv('METRICS_PATH')}.worker{index}"
+    return env
+
+
+class Worker:
+    """One server.py process and its restart policy"""
+
+    def __init__(self, index, shard_ids, shard_count):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.env = worker_env(index, shard_ids, shard_count)
+        self.process = None
+        self.restarts = 0
+        self.restart_at = 0.0
+
+    def start(self):
+        logger.info('Starting worker %s with shards %s', self.index, self.shard_ids)
+        self.process = subprocess.Popen([sys.executable, "server.py"], env=self.env)
+
+    def check(self, now):
+        """Restarts the worker when it died, after 5s doubling up to 5 minutes"""
+        if self.process.poll() is None:
+            return
+        if not self.restart_at:
+            delay = min(300, 5 * 2 ** self.restarts)
+            logger.error('Worker %s exited with %s, restarting in %ss', self.index, self.process.returncode, delay)
+            self.restart_at = now + delay
+        elif now >= self.restart_at:
+            self.restarts += 1
+            self.restart_at = 0.0
+            self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot sharded over several worker processes")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SHARD_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--shards', type=int, default=int(os.getenv('SHARD_COUNT', 0)),
+                        help="total shard count, defaults to Discord's recommendation")
+    args = parser.parse_args()
+
+    if os.getenv('DB_BACKEND', 'sqlite') != 'sqlite':
+        sys.exit("Sharded workers share their records, set DB_BACKEND=sqlite.")
+    # at least one shard per worker, more than Discord recommends is fine
+    shard_count = args.shards or max(asyncio.run(recommended_shards()), args.workers)
+    ranges = shard_ranges(shard_count, args.workers)
+    logger.info('Running %s shards on %s workers', shard_count, len(ranges))
+
+    workers = [Worker(index, shard_ids, shard_count) for index, shard_ids in enumerate(ranges)]
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        for worker in workers:
+            if stopping:
+                break
+            worker.start()
+            started = time.monotonic()
+            while not stopping and time.monotonic() - started < IDENTIFY_INTERVAL * len(worker.shard_ids):
+                time.sleep(0.5)
+        while not stopping:
+            now = time.monotonic()
+            for worker in workers:
+                worker.check(now)
+            time.sleep(1)
+    finally:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            if worker.process is not None:
+                worker.process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@
 This module loads the token, cogs, and runs the bot app
 """
 
+import time
+import asyncio
 import logging.config
 import os
 from os import listdir
@@ -11,6 +13,14 @@ import discord
 from discord.ext import commands
 from discord_slash import SlashCommand
 from dotenv import load_dotenv, find_dotenv
+from utils.slash_sync import sync_changed_commands
+from utils.metrics import instrument_discord_http, instrument_slash_commands, monitor_loop_lag, serve_metrics
+from utils.watchdog import StallWatchdog, STALL_WATCHDOG
+from utils.sharding import SHARD_COUNT, SHARD_IDS, WORKER_INDEX, is_sharded
+
+# Startup phase timings, logged once the bot is ready
+boot_started = time.perf_counter()
+boot_phases = {}
 
 # Load Discord secret token from .env file
 load_dotenv(find_dotenv())
@@ -23,12 +33,38 @@ logger = logging.getLogger(__name__)
 # Cog directory. 'meme.py' in cogs directory is be cogs.meme
 cogs_dir = "cogs"
 
-bot = commands.Bot(command_prefix="!", description='The Nestr bot using slash commands', self_bot=True,
+bot_options = dict(command_prefix="!", description='The Nestr bot using slash commands', self_bot=True,
                    intents=discord.Intents.default(), allowed_mentions=discord.AllowedMentions.all())
-slash = SlashCommand(bot, sync_commands=True)
+if is_sharded():
+    # started by launcher.py: this worker owns SHARD_IDS out of SHARD_COUNT shards
+    bot = commands.AutoShardedBot(shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **bot_options)
+    logger.info('Worker %s running shards %s of %s', WORKER_INDEX, SHARD_IDS, SHARD_COUNT)
+else:
+    bot = commands.Bot(**bot_options)
+
+
+async def close_bot():
+    # unloads the cogs first; their shared Nestr client outlives cog reloads, so it is closed here
+    await type(bot).close(bot)
+    if getattr(bot, 'nestr_client', None) is not None:
+        await bot.nestr_client.close()
+bot.close = close_bot
+
+# commands are registered in on_ready, only for scopes whose schema changed
+slash = SlashCommand(bot, sync_commands=False)
+instrument_discord_http(bot.http)
+instrument_slash_commands(slash)
+
+# Opt-in (STALL_WATCHDOG=1): report callbacks that block the event loop to stalls.log
+bot.stall_watchdog = None
+if STALL_WATCHDOG:
+    bot.stall_watchdog = StallWatchdog()
+    bot.loop.create_task(bot.stall_watchdog.heartbeat())
 
 # Load the extensions(cogs) that are located in the cogs directory. Any file in here attempts to load.
 if __name__ == '__main__':
+    boot_phases['setup'] = time.perf_counter() - boot_started
+    phase_started = time.perf_counter()
     for extension in [f.replace('.py', '') for f in listdir(cogs_dir) if isfile(join(cogs_dir, f))]:
         try:
             bot.load_extension(cogs_dir + "." + extension)
@@ -40,6 +76,8 @@ if __name__ == '__main__':
             print(ModuleNotFoundError)
             logger.error('Failed to load extension: %s', extension)
             traceback.print_exc()
+    boot_phases['extensions'] = time.perf_counter() - phase_started
+    phase_started = time.perf_counter()
 
 
 @bot.event
@@ -52,4 +90,21 @@ async def on_ready():
     logger.info('Successfully logged in and booted...!')
     logger.info('Logged in as: %s - %s\nVersion: %s', bot.user.name, bot.user.id, discord.__version__)
 
+    # on_ready fires again after reconnects, only register commands once;
+    # when sharded only the worker owning shard 0 does
+    if 'connect' not in boot_phases:
+        boot_phases['connect'] = time.perf_counter() - phase_started
+        if not is_sharded() or 0 in SHARD_IDS:
+            commands_started = time.perf_counter()
+            try:
+                await sync_changed_commands(slash)
+            except discord.HTTPException:
+                logger.exception('Failed to register slash commands')
+            boot_phases['commands'] = time.perf_counter() - commands_started
+        asyncio.ensure_future(monitor_loop_lag())
+        asyncio.ensure_future(serve_metrics())
+        logger.info('Boot phases: %s, total %.2fs',
+                    ', '.join(f'{name} {seconds:.2f}s' for name, seconds in boot_phases.items()),
+                    time.perf_counter() - boot_started)
+
 bot.run(TOKEN, bot=True, reconnect=True)
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+Small in-memory caches used by the cogs
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+NESTR_CACHE_TTL = float(os.getenv('NESTR_CACHE_TTL', 60))
+NESTR_CACHE_SIZE = int(os.getenv('NESTR_CACHE_SIZE', 1024))
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, maxsize=NESTR_CACHE_SIZE, ttl=NESTR_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, predicate):
+        """
+        Removes every entry whose key matches predicate(key).
+        :return: number of removed entries
+        """
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def dump(self):
+        """
+        Live entries, oldest first, for a snapshot.
+        :return: list of (key, remaining ttl in seconds, value)
+        """
+        now = time.monotonic()
+        return [(key, expires_at - now, value) for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+    def load(self, entries, age=0.0):
+        """
+        Restores entries produced by dump(), `age` seconds after they were dumped.
+        :return: number of restored entries
+        """
+        restored = 0
+        for key, remaining, value in entries:
+            if remaining - age > 0:
+                self.set(key, value, ttl=remaining - age)
+                restored += 1
+        return restored
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0}
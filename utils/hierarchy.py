@@ -0,0 +1,40 @@
+"""
+Builds the circle/role tree of a Nestr workspace from flat search results
+"""
+
+
+def build_tree(root_id, roles, circles):
+    """
+    Rebuilds the parent/child tree under `root_id` from flat lists of role and
+    circle nodes, using `parentId` (or the nearest known circle in `ancestors`).
+    Nodes that do not hang below the root are left out.
+    :return: (roles, [(subcircle, subtree), ...]) with children in result order
+    """
+    circle_ids = {circle.get('_id') for circle in circles}
+    circle_ids.add(root_id)
+
+    def parent_of(node):
+        parent = node.get('parentId')
+        if parent in circle_ids:
+            return parent
+        for ancestor in reversed(node.get('ancestors') or []):
+            if ancestor in circle_ids:
+                return ancestor
+        return None
+
+    roles_by_parent = {}
+    for role in roles:
+        roles_by_parent.setdefault(parent_of(role), []).append(role)
+    circles_by_parent = {}
+    for circle in circles:
+        if circle.get('_id') != root_id:
+            circles_by_parent.setdefault(parent_of(circle), []).append(circle)
+
+    seen = set()
+
+    def subtree(circle_id):
+        seen.add(circle_id)
+        children = [circle for circle in circles_by_parent.get(circle_id, []) if circle.get('_id') not in seen]
+        return roles_by_parent.get(circle_id, []), [(circle, subtree(circle.get('_id'))) for circle in children]
+
+    return subtree(root_id)
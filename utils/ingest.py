@@ -0,0 +1,81 @@
+"""
+Bounded, non-blocking ingestion pipeline for webhook messages.
+
+Listeners only parse and submit jobs; a fixed pool of async workers runs the
+handler. Jobs with the same key always go to the same worker, so they are
+handled in the order they arrived.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+
+
+class IngestPipeline:
+    """Sharded job queues drained by async workers, with backpressure metrics"""
+
+    def __init__(self, handler, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE, name="ingest"):
+        """
+        :param handler: coroutine function called with each submitted job
+        :param workers: number of workers, each owning one queue
+        :param maxsize: total queued jobs before submit() waits
+        """
+        self.logger = logging.getLogger(__name__)
+        self.handler = handler
+        self.name = name
+        self.queues = [asyncio.Queue(max(1, maxsize // workers)) for _ in range(workers)]
+        self.tasks = []
+        self.high_water = 0
+
+    @property
+    def depth(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def start(self):
+        # started lazily from the first submit, the cog is created before the loop runs
+        if not self.tasks:
+            self.tasks = [asyncio.ensure_future(self._worker(queue)) for queue in self.queues]
+
+    async def submit(self, key, job):
+        """
+        Queues a job. When the worker's queue is full this waits (backpressure)
+        instead of dropping the job.
+        :param key: jobs with equal keys are handled in order
+        """
+        self.start()
+        queue = self.queues[hash(key) % len(self.queues)]
+        if queue.full():
+            started = time.monotonic()
+            await queue.put((time.monotonic(), job))
+            waited = time.monotonic() - started
+            self.logger.warning('%s queue full, submit waited %.2fs', self.name, waited)
+        else:
+            queue.put_nowait((time.monotonic(), job))
+        self.high_water = max(self.high_water, self.depth)
+
+    async def _worker(self, queue):
+        while True:
+            queued_at, job = await queue.get()
+            try:
+                await self.handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.exception('%s job failed after %.2fs in queue', self.name, time.monotonic() - queued_at)
+            finally:
+                queue.task_done()
+
+    async def close(self, timeout=10):
+        """Waits up to `timeout` seconds for queued jobs, then stops the workers"""
+        if self.tasks:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), timeout)
+            except asyncio.TimeoutError:
+                self.logger.error('%s closed with %s jobs still queued', self.name, self.depth)
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
@@ -0,0 +1,267 @@
+"""
+Process wide performance metrics, shown by /stats and exported in the Prometheus text format
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# exporters, both off unless configured
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PATH = os.getenv('METRICS_PATH', '')
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 15))
+
+# latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of one labelled series"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Counters, histograms and sampled gauges, keyed on metric name and labels"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the duration of the block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def gauge(self, name, sample, **labels):
+        """
+        Registers a gauge sampled at export time, replacing an earlier one with the same labels.
+        :param sample: callable returning the current value
+        """
+        self.gauges.setdefault(name, {})[_label_key(labels)] = sample
+
+    def remove_gauges(self, prefix):
+        """Drops the gauges of an unloaded cog so their samplers can be collected"""
+        for name in [name for name in self.gauges if name.startswith(prefix)]:
+            del self.gauges[name]
+
+    def sample_gauges(self):
+        values = {}
+        for name, series in self.gauges.items():
+            for key, sample in series.items():
+                try:
+                    values.setdefault(name, {})[key] = float(sample())
+                except Exception:  # a broken sampler must not break the export
+                    logging.getLogger(__name__).exception('Gauge %s failed', name)
+        return values
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+
+        def header(name, kind):
+            if name in self.help:
+                lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for name, series in sorted(self.counters.items()):
+            header(name, 'counter')
+            lines.extend(f'{name}{_format_labels(key)} {value}' for key, value in sorted(series.items()))
+        for name, series in sorted(self.histograms.items()):
+            header(name, 'histogram')
+            for key, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        for name, series in sorted(self.sample_gauges().items()):
+            header(name, 'gauge')
+            lines.extend(f'{name}{_format_labels(key)} {value:g}' for key, value in sorted(series.items()))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, limit=10):
+        """
+        Short human readable sections for /stats.
+        :return: dict of section title -> list of lines
+        """
+        sections = {}
+        for name, series in sorted(self.histograms.items()):
+            rows = sorted(series.items(), key=lambda item: item[1].count, reverse=True)[:limit]
+            sections[self.help.get(name, name)] = [
+                f"{' '.join(str(value) for _, value in key) or 'all'}: n={histogram.count} "
+                f"avg={histogram.sum / histogram.count * 1000:.0f}ms p95<={histogram.quantile(0.95) * 1000:g}ms"
+                for key, histogram in rows]
+        for name, series in sorted(self.counters.items()):
+            rows = sorted(series.items(), key=lambda item: item[1], reverse=True)[:limit]
+            sections[self.help.get(name, name)] = [
+                f"{' '.join(str(value) for _, value in key) or 'all'}: {value}" for key, value in rows]
+        gauges = self.sample_gauges()
+        if gauges:
+            sections['Gauges'] = [
+                f"{name}{' ' + ' '.join(str(value) for _, value in key) if key else ''}: {value:g}"
+                for name, series in sorted(gauges.items()) for key, value in sorted(series.items())]
+        return sections
+
+
+metrics = Metrics()
+metrics.describe('nestr_command_seconds', 'Slash command time to first response')
+metrics.describe('nestr_api_seconds', 'Nestr API latency')
+metrics.describe('nestr_api_requests_total', 'Nestr API responses by status')
+metrics.describe('nestr_api_queue_seconds', 'Nestr request slot wait')
+metrics.describe('nestr_api_coalesced_total', 'Nestr requests sharing an identical call')
+metrics.describe('nestr_storage_seconds', 'Storage operation latency')
+metrics.describe('nestr_discord_requests_total', 'Discord REST requests')
+metrics.describe('nestr_loop_lag_seconds', 'Event loop lag')
+metrics.describe('nestr_loop_stall_seconds', 'Event loop stalls')
+
+
+def instrument_discord_http(http):
+    """Counts the REST calls of a discord.py HTTPClient by method and route template"""
+    request = http.request
+
+    @functools.wraps(request)
+    async def counted(route, **kwargs):
+        metrics.inc('nestr_discord_requests_total', method=route.method, route=route.path)
+        return await request(route, **kwargs)
+
+    http.request = counted
+
+
+def instrument_slash_commands(slash):
+    """
+    Records how long every slash command takes to its first response, a send or defer.
+    What follows, e.g. a paginator waiting for button clicks, is the user's time, not ours.
+    """
+    invoke_command = slash.invoke_command
+
+    @functools.wraps(invoke_command)
+    async def timed(func, ctx, args):
+        started = time.perf_counter()
+        observed = False
+
+        def responded():
+            nonlocal observed
+            if not observed:
+                observed = True
+                metrics.observe('nestr_command_seconds', time.perf_counter() - started, command=ctx.name)
+
+        def first_response(method):
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    responded()
+            return wrapper
+
+        ctx.send = first_response(ctx.send)
+        ctx.defer = first_response(ctx.defer)
+        try:
+            await invoke_command(func, ctx, args)
+        finally:
+            # commands that never responded count until they returned or raised
+            responded()
+
+    slash.invoke_command = timed
+
+
+async def monitor_loop_lag(interval=1.0):
+    """Samples how late the event loop wakes up from a sleep of `interval` seconds"""
+    loop = asyncio.get_running_loop()
+    lag = 0.0
+    metrics.gauge('nestr_loop_lag_last_seconds', lambda: lag)
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        metrics.observe('nestr_loop_lag_seconds', lag)
+
+
+async def serve_metrics(host=METRICS_HOST, port=METRICS_PORT, path=METRICS_PATH, interval=METRICS_INTERVAL):
+    """Exposes /metrics over HTTP when `port` is set and writes the text file when `path` is set"""
+    logger = logging.getLogger(__name__)
+    if port:
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info('Serving metrics on http://%s:%s/metrics', host, port)
+    while path:
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as handle:
+                handle.write(metrics.render())
+            os.replace(tmp_path, path)
+        except OSError as err:
+            logger.warning('Unable to write metrics to %s: %s', path, err)
+        await asyncio.sleep(interval)
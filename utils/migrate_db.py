@@ -0,0 +1,43 @@
+"""
+One-shot migration of the TinyDB db.json into the SQLite backend.
+
+Usage: python -m utils.migrate_db [--json /app/db.json] [--sqlite /app/db.sqlite3]
+Running it again is safe, records are upserted on their primary keys.
+"""
+
+import argparse
+import json
+
+from utils.sqlite_storage import SQLiteDB, table_for
+
+
+def migrate(json_path, sqlite_path):
+    with open(json_path, encoding='utf-8') as handle:
+        content = handle.read()
+    tables = json.loads(content) if content.strip() else {}
+    db = SQLiteDB(sqlite_path)
+    counts = {}
+    try:
+        for records in tables.values():
+            for record in records.values():
+                table = table_for(record)
+                db.insert(record)
+                counts[table] = counts.get(table, 0) + 1
+        db.flush(durable=True)
+    finally:
+        db.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import db.json into the SQLite storage backend")
+    parser.add_argument('--json', default='/app/db.json', help="TinyDB file to import")
+    parser.add_argument('--sqlite', default='/app/db.sqlite3', help="SQLite database to create or update")
+    args = parser.parse_args()
+    counts = migrate(args.json, args.sqlite)
+    for table, count in sorted(counts.items()):
+        print(f'{table}: {count} records')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Rate-limit-aware scheduler for bulk Discord guild mutations.
+
+Mutations are grouped per rate-limit route (role creation, channel edits, ...).
+Each route is worked off sequentially, so discord.py's bucket handling can pace
+it without 429 storms, while different routes run concurrently.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import aiohttp
+import discord
+
+DISCORD_MUTATION_INTERVAL = float(os.getenv('DISCORD_MUTATION_INTERVAL', 0.0))
+DISCORD_MUTATION_RETRIES = int(os.getenv('DISCORD_MUTATION_RETRIES', 3))
+DISCORD_PROGRESS_INTERVAL = float(os.getenv('DISCORD_PROGRESS_INTERVAL', 3.0))
+
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+
+class MutationQueue:
+    """Runs (route, coroutine function) jobs per route, retrying transient failures"""
+
+    def __init__(self, interval=DISCORD_MUTATION_INTERVAL, retries=DISCORD_MUTATION_RETRIES,
+                 backoff=1.0, progress_interval=DISCORD_PROGRESS_INTERVAL):
+        self.logger = logging.getLogger(__name__)
+        self.interval = interval
+        self.retries = retries
+        self.backoff = backoff
+        self.progress_interval = progress_interval
+        self.jobs = []
+        self.done = 0
+        self.retried = 0
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, route, job):
+        """
+        :param route: rate-limit route key, jobs on the same route run in order
+        :param job: coroutine function performing one Discord call
+        """
+        self.jobs.append((route, job))
+
+    async def _call(self, route, job):
+        attempt = 0
+        while True:
+            try:
+                return await job()
+            except discord.HTTPException as err:
+                if err.status not in TRANSIENT_STATUSES or attempt >= self.retries:
+                    raise
+                error = err
+            except (asyncio.TimeoutError, aiohttp.ClientError) as err:
+                if attempt >= self.retries:
+                    raise
+                error = err
+            delay = self.backoff * (2 ** attempt)
+            attempt += 1
+            self.retried += 1
+            self.logger.warning('Retrying %s in %.1fs after %s', route, delay, error)
+            await asyncio.sleep(delay)
+
+    def eta(self, started):
+        if not self.done:
+            return None
+        return (time.monotonic() - started) / self.done * (len(self.jobs) - self.done)
+
+    async def run(self, on_progress=None):
+        """
+        Executes all queued jobs.
+        :param on_progress: coroutine function called as on_progress(done, total, eta_seconds),
+                            at most every `progress_interval` seconds and once at the end
+        :raises: the first failed job's error, once the other routes have been stopped
+        """
+        routes = OrderedDict()
+        for route, job in self.jobs:
+            routes.setdefault(route, []).append(job)
+        started = time.monotonic()
+        last_report = started
+
+        async def report(force=False):
+            nonlocal last_report
+            if on_progress is None:
+                return
+            now = time.monotonic()
+            if force or now - last_report >= self.progress_interval:
+                last_report = now
+                try:
+                    await on_progress(self.done, len(self.jobs), self.eta(started))
+                except discord.HTTPException as err:
+                    self.logger.warning('Unable to report progress: %s', err)
+
+        async def worker(route, jobs):
+            for job in jobs:
+                call_started = time.monotonic()
+                await self._call(route, job)
+                self.done += 1
+                await report()
+                wait = self.interval - (time.monotonic() - call_started)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+        workers = [asyncio.ensure_future(worker(route, jobs)) for route, jobs in routes.items()]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # a failed route stops the others, nothing may change after the error is reported
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        await report(force=True)
+        self.logger.info('Ran %s Discord mutations on %s routes in %.1fs (%s retries)',
+                         self.done, len(routes), time.monotonic() - started, self.retried)
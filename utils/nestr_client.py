@@ -0,0 +1,260 @@
+"""
+Async client for the Nestr REST API.
+
+A single pooled, keep-alive aiohttp session is shared by the whole bot process
+so Nestr calls never block the discord.py event loop.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+
+import aiohttp
+
+from utils.metrics import metrics
+
+NESTR_TIMEOUT = float(os.getenv('NESTR_TIMEOUT', 15))
+NESTR_RETRIES = int(os.getenv('NESTR_RETRIES', 3))
+NESTR_BACKOFF = float(os.getenv('NESTR_BACKOFF', 0.5))
+NESTR_POOL_SIZE = int(os.getenv('NESTR_POOL_SIZE', 100))
+NESTR_PAGE_SIZE = int(os.getenv('NESTR_PAGE_SIZE', 100))
+NESTR_MAX_ITEMS = int(os.getenv('NESTR_MAX_ITEMS', 1000))
+# requests in flight per Nestr token and for the whole process, the excess waits its turn
+NESTR_TOKEN_CONCURRENCY = int(os.getenv('NESTR_TOKEN_CONCURRENCY', 8))
+NESTR_MAX_CONCURRENCY = int(os.getenv('NESTR_MAX_CONCURRENCY', 32))
+
+
+class NestrError(Exception):
+    """Base error for failed Nestr API calls"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class NestrAuthError(NestrError):
+    """The stored Nestr token was rejected (HTTP 401)"""
+
+    def __init__(self, message="Invalid login data, please `/login` to Nestr first.", status=401):
+        super().__init__(message, status)
+
+
+class NestrRateLimitError(NestrError):
+    """Nestr kept answering HTTP 429 after all retries"""
+
+
+class NestrServerError(NestrError):
+    """Nestr kept answering HTTP 5xx after all retries"""
+
+
+class NestrTimeoutError(NestrError):
+    """Nestr did not answer in time or the connection failed"""
+
+
+async def paginate(fetch_page, page_size=NESTR_PAGE_SIZE, max_items=NESTR_MAX_ITEMS):
+    """
+    Async iterator walking skip/limit pages of a Nestr search.
+    Page N+1 is requested while page N is being consumed, so at most two pages
+    are held in memory. Iteration stops after max_items or on a short page.
+    :param fetch_page: coroutine function called as fetch_page(limit, skip)
+    :param page_size: items requested per page
+    :param max_items: stop after yielding this many items (None for no cap)
+    """
+    if max_items is not None:
+        page_size = min(page_size, max_items)
+    skip = 0
+    yielded = 0
+    pending = asyncio.ensure_future(fetch_page(page_size, skip))
+    try:
+        while pending is not None:
+            page = await pending or []
+            pending = None
+            skip += len(page)
+            if len(page) >= page_size and (max_items is None or skip < max_items):
+                pending = asyncio.ensure_future(fetch_page(page_size, skip))
+            for item in page:
+                if max_items is not None and yielded >= max_items:
+                    return
+                yield item
+                yielded += 1
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+
+
+class NestrClient:
+    """Pooled async client for the Nestr API"""
+
+    def __init__(self, base_url, timeout=NESTR_TIMEOUT, retries=NESTR_RETRIES, backoff=NESTR_BACKOFF,
+                 pool_size=NESTR_POOL_SIZE, token_concurrency=NESTR_TOKEN_CONCURRENCY,
+                 max_concurrency=NESTR_MAX_CONCURRENCY):
+        self.logger = logging.getLogger(__name__)
+        self.base_url = base_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.token_concurrency = token_concurrency
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._global_slots = None
+        # token -> (semaphore, users), dropped when no request of the token is left
+        self._token_slots = {}
+        # (method, path, params, token) -> task of the identical request in flight
+        self._inflight = {}
+        self.active = 0
+        self.waiting = 0
+        metrics.gauge('nestr_api_active', lambda: self.active)
+        metrics.gauge('nestr_api_waiting', lambda: self.waiting)
+        metrics.gauge('nestr_api_coalescing', lambda: len(self._inflight))
+
+    @property
+    def session(self):
+        # created lazily so it is bound to the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @staticmethod
+    def auth_headers(user):
+        return {'X-Auth-Token': user['token'], 'X-User-Id': user['nestr_id']}
+
+    async def request(self, method, path, user, params=None, data=None, idempotent=True):
+        """
+        Sends a request to Nestr and returns the decoded JSON body.
+        Identical idempotent requests of the same user share one call while it is in flight.
+        Retries with exponential backoff on 429, and on 5xx/timeouts when idempotent.
+        :param method: HTTP method
+        :param path: path below the API base url
+        :param user: db user record holding 'token' and 'nestr_id'
+        :param params: query string parameters
+        :param data: form data for the body
+        :param idempotent: whether the request can safely be repeated after a 5xx
+        """
+        # label by the first path segment, the rest carries ids and search text
+        endpoint = method + ' /' + path.lstrip('/').split('/', 1)[0]
+        if not idempotent or data is not None:
+            return await self._request(method, path, endpoint, user, params, data, idempotent)
+
+        key = (method, path, tuple(sorted((params or {}).items())), user['nestr_id'], user['token'])
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request(method, path, endpoint, user, params, data, idempotent))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            metrics.inc('nestr_api_coalesced_total', endpoint=endpoint)
+        # shielded: one caller giving up must not cancel the call the others wait for
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        self._inflight.pop(key, None)
+        # retrieved here too, every caller may have been cancelled meanwhile
+        if not task.cancelled():
+            task.exception()
+
+    @asynccontextmanager
+    async def slot(self, user):
+        """
+        Waits for a free per-token and then a free global request slot, so a busy
+        token queues on its own slots without holding global ones.
+        """
+        if self._global_slots is None:
+            self._global_slots = asyncio.Semaphore(self.max_concurrency)
+        token = user['token']
+        semaphore, users = self._token_slots.get(token, (None, 0))
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.token_concurrency)
+        self._token_slots[token] = (semaphore, users + 1)
+        started = time.perf_counter()
+        self.waiting += 1
+        waited = False
+        try:
+            async with semaphore, self._global_slots:
+                self.waiting -= 1
+                waited = True
+                metrics.observe('nestr_api_queue_seconds', time.perf_counter() - started)
+                self.active += 1
+                try:
+                    yield
+                finally:
+                    self.active -= 1
+        finally:
+            if not waited:
+                self.waiting -= 1
+            semaphore, users = self._token_slots[token]
+            if users == 1:
+                del self._token_slots[token]
+            else:
+                self._token_slots[token] = (semaphore, users - 1)
+
+    async def _request(self, method, path, endpoint, user, params, data, idempotent):
+        url = self.base_url + path
+        attempt = 0
+        while True:
+            delay = self.backoff * (2 ** attempt)
+            async with self.slot(user):
+                started = time.perf_counter()
+                status = 'error'
+                try:
+                    async with self.session.request(method, url, params=params, data=data,
+                                                    headers=self.auth_headers(user)) as resp:
+                        status = resp.status
+                        if resp.status == 401:
+                            raise NestrAuthError()
+                        if resp.status == 429:
+                            error = NestrRateLimitError("Nestr is rate limiting requests, try again later.", resp.status)
+                            retry_after = resp.headers.get('Retry-After')
+                            if retry_after and retry_after.replace('.', '', 1).isdigit():
+                                delay = max(delay, float(retry_after))
+                        elif resp.status >= 500:
+                            error = NestrServerError(f"Nestr API error ({resp.status}).", resp.status)
+                            if not idempotent:
+                                raise error
+                        elif resp.status >= 400:
+                            body = await resp.text()
+                            self.logger.warning('Nestr %s %s failed with %s: %s', method, path, resp.status, body[:500])
+                            raise NestrError(f"Nestr API error ({resp.status}).", resp.status)
+                        else:
+                            if resp.content_type == 'application/json':
+                                return await resp.json()
+                            return await resp.text()
+                except (asyncio.TimeoutError, aiohttp.ClientError) as err:
+                    status = 'timeout'
+                    error = NestrTimeoutError(f"Nestr did not respond: {type(err).__name__}")
+                    if not idempotent:
+                        raise error from err
+                finally:
+                    metrics.observe('nestr_api_seconds', time.perf_counter() - started, endpoint=endpoint)
+                    metrics.inc('nestr_api_requests_total', endpoint=endpoint, status=status)
+
+            # the slot is free again while backing off
+            attempt += 1
+            if attempt > self.retries:
+                raise error
+            self.logger.info('Retrying Nestr %s %s in %.1fs (%s)', method, path, delay, error)
+            await asyncio.sleep(delay)
+
+    async def search(self, user, text, limit=100, skip=0, context_id=None):
+        params = {'limit': limit, 'skip': skip}
+        if context_id is not None:
+            params['contextId'] = context_id
+        body = await self.request('GET', "/search/" + quote(text, safe=":,!"), user, params=params)
+        return body.get('data') if isinstance(body, dict) else None
+
+    async def discord_sync(self, user, workspace_id, webhook_url):
+        return await self.request('POST', f"/discordsync/{workspace_id}", user,
+                                  params={'webhookUrl': webhook_url})
+
+    async def create_inbox(self, user, title):
+        return await self.request('POST', "/n/inbox", user,
+                                  data={"parentId": "inbox", "title": title}, idempotent=False)
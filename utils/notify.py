@@ -0,0 +1,114 @@
+"""
+Coalescing dispatcher for Nestr notification DMs.
+
+Notifications for the same user arriving within a short window are merged into
+one multi-field embed (split where Discord's embed limits require it). Users are
+served concurrently, while each user's DMs keep their arrival order.
+"""
+
+import asyncio
+import logging
+import os
+
+import discord
+
+from utils.text import clip, EMBED_TOTAL, EMBED_FIELDS, FIELD_NAME, FIELD_VALUE
+
+NOTIFY_WINDOW = float(os.getenv('NOTIFY_WINDOW', 2.0))
+
+
+def build_embeds(notifications):
+    """
+    Packs notifications into as few embeds as the embed limits allow.
+    A single notification keeps the classic one-field layout.
+    """
+    if len(notifications) == 1:
+        title, content, url = notifications[0]
+        embed = discord.Embed(title="Nestr Notification", description=clip(title, 4096), color=0x4A44EE, url=url)
+        embed.add_field(name="Contents", value=clip(content, FIELD_VALUE))
+        return [embed]
+
+    embeds = []
+    embed = None
+    for title, content, url in notifications:
+        name = clip(title or "Notification", FIELD_NAME)
+        value = clip(f"{content}\n🔗 [link]({url})" if url else content, FIELD_VALUE)
+        if embed is None or len(embed.fields) >= EMBED_FIELDS or len(embed) + len(name) + len(value) > EMBED_TOTAL - 32:
+            embed = discord.Embed(title="Nestr Notifications", color=0x4A44EE)
+            embeds.append(embed)
+        # 32 chars are kept free for the description set below
+        embed.add_field(name=name, value=value, inline=False)
+    for embed in embeds:
+        embed.description = f"{len(embed.fields)} notifications"
+    return embeds
+
+
+class NotificationDispatcher:
+    """Buffers notifications per user and sends them as coalesced DMs"""
+
+    def __init__(self, resolve_member, window=NOTIFY_WINDOW):
+        """
+        :param resolve_member: coroutine function (guild, discord_id) -> member or None
+        :param window: seconds to wait for more notifications for the same user
+        """
+        self.logger = logging.getLogger(__name__)
+        self.resolve_member = resolve_member
+        self.window = window
+        # (guild_id, discord_id) -> (guild, [(title, content, url), ...])
+        self.pending = {}
+        self.timers = {}
+        self.locks = {}
+        self.received = 0
+        self.sent = 0
+
+    async def notify(self, guild, discord_id, title, content, url=""):
+        key = (guild.id, discord_id)
+        self.pending.setdefault(key, (guild, []))[1].append((title, content, url))
+        self.received += 1
+        if key not in self.timers:
+            self.timers[key] = asyncio.ensure_future(self._flush_later(key))
+
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.window)
+        await self._flush(key)
+
+    async def _flush(self, key):
+        self.timers.pop(key, None)
+        if key not in self.pending:
+            return
+        guild, batch = self.pending.pop(key)
+        # the lock keeps batches of one user in order while others send concurrently
+        lock, users = self.locks.get(key, (asyncio.Lock(), 0))
+        self.locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                await self._send(guild, key[1], batch)
+        finally:
+            lock, users = self.locks[key]
+            if users == 1:
+                del self.locks[key]
+            else:
+                self.locks[key] = (lock, users - 1)
+
+    async def _send(self, guild, discord_id, batch):
+        member = await self.resolve_member(guild, discord_id)
+        if member is None:
+            self.logger.info('Dropping %s notifications for unknown member %s', len(batch), discord_id)
+            return
+        try:
+            for embed in build_embeds(batch):
+                await member.send(embed=embed)
+                self.sent += 1
+        except discord.HTTPException as err:
+            self.logger.warning('Unable to DM %s: %s', discord_id, err)
+
+    async def close(self):
+        """Sends everything still buffered right away"""
+        for timer in self.timers.values():
+            timer.cancel()
+        await asyncio.gather(*(self._flush(key) for key in list(self.pending)))
+
+    def stats(self):
+        return {'buffered': sum(len(batch) for guild, batch in self.pending.values()),
+                'received': self.received,
+                'sent': self.sent}
@@ -0,0 +1,129 @@
+"""
+Lazy, button-driven embed paginator.
+
+Fields are pulled from an async iterator only when a page needs them, packed
+into embeds within Discord's limits, and later pages are rendered when the
+Prev/Next buttons are clicked. One message, one page of work up front.
+"""
+
+import asyncio
+import uuid
+
+import discord
+from discord_slash.model import ButtonStyle
+from discord_slash.utils.manage_components import wait_for_component, create_button, create_actionrow
+
+from utils.text import clip, EMBED_TOTAL, EMBED_FIELDS, FIELD_NAME, FIELD_VALUE
+
+# room kept for the "Page N" footer
+FOOTER_RESERVE = 32
+
+
+async def grouped(items, key):
+    """
+    Groups an async iterator by key over the whole result, so every key is
+    yielded once however its items are interleaved.
+    Yields (key, [items]) with keys in first-seen order.
+    """
+    groups = {}
+    async for item in items:
+        groups.setdefault(key(item), []).append(item)
+    for group in groups.items():
+        yield group
+
+
+class EmbedPaginator:
+    """Pages of (name, value) fields pulled lazily from an async iterator"""
+
+    def __init__(self, fields, title, description="", url=None, color=0x4A44EE, empty=("No results found", "...")):
+        """
+        :param fields: async iterator of (name, value) tuples
+        :param empty: field shown when the iterator yields nothing
+        """
+        self.fields = fields.__aiter__()
+        self.title = title
+        self.description = description
+        self.url = url
+        self.color = color
+        self.empty = empty
+        self.pages = []
+        self.exhausted = False
+        self._carry = None
+
+    async def _next_field(self):
+        if self._carry is not None:
+            field, self._carry = self._carry, None
+            return field
+        if self.exhausted:
+            return None
+        try:
+            name, value = await self.fields.__anext__()
+        except StopAsyncIteration:
+            self.exhausted = True
+            return None
+        return clip(name, FIELD_NAME), clip(value, FIELD_VALUE)
+
+    async def _fill(self, index):
+        base = len(self.title) + len(self.description) + FOOTER_RESERVE
+        while len(self.pages) <= index:
+            page = []
+            size = base
+            while len(page) < EMBED_FIELDS:
+                field = await self._next_field()
+                if field is None:
+                    break
+                if page and size + len(field[0]) + len(field[1]) > EMBED_TOTAL:
+                    self._carry = field
+                    break
+                page.append(field)
+                size += len(field[0]) + len(field[1])
+            if not page:
+                break
+            self.pages.append(page)
+        # peek one field ahead so we know whether to enable "Next"
+        if self._carry is None and not self.exhausted:
+            self._carry = await self._next_field()
+
+    def has_next(self, index):
+        return index + 1 < len(self.pages) or self._carry is not None
+
+    async def embed(self, index):
+        await self._fill(index)
+        embed = discord.Embed(title=self.title, description=self.description, color=self.color, url=self.url or discord.Embed.Empty)
+        fields = self.pages[index] if index < len(self.pages) else [self.empty]
+        for name, value in fields:
+            embed.add_field(name=name, value=value, inline=False)
+        if index > 0 or self.has_next(index):
+            embed.set_footer(text=f"Page {index + 1}" + ("" if self.has_next(index) else " (last)"))
+        return embed
+
+    def buttons(self, index, prefix):
+        return create_actionrow(
+            create_button(style=ButtonStyle.gray, label="◀ Prev", custom_id=f"{prefix}:prev", disabled=index == 0),
+            create_button(style=ButtonStyle.gray, label="Next ▶", custom_id=f"{prefix}:next", disabled=not self.has_next(index)),
+        )
+
+    async def send(self, ctx, bot, timeout=300):
+        """
+        Sends the first page and serves Prev/Next clicks of the command author
+        until `timeout` seconds pass without a click.
+        """
+        index = 0
+        embed = await self.embed(index)
+        if not self.has_next(index):
+            await ctx.send(embed=embed)
+            return
+        prefix = uuid.uuid4().hex
+        row = self.buttons(index, prefix)
+        message = await ctx.send(embed=embed, components=[row])
+        while True:
+            try:
+                button_ctx = await wait_for_component(bot, components=[f"{prefix}:prev", f"{prefix}:next"],
+                                                      check=lambda c: c.author_id == ctx.author_id, timeout=timeout)
+            except asyncio.TimeoutError:
+                if message is not None:
+                    await message.edit(components=[])
+                return
+            index = max(0, index - 1) if button_ctx.custom_id.endswith(":prev") else index + 1
+            embed = await self.embed(index)
+            await button_ctx.edit_origin(embed=embed, components=[self.buttons(index, prefix)])
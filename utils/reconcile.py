@@ -0,0 +1,295 @@
+"""
+Diff-based reconciliation of a Nestr workspace tree with a Discord guild.
+
+plan_workspace() compares the fetched Nestr tree with the stored role/circle
+records (keyed by role_id/circle_id) and the guild's current roles and channels,
+and returns a Plan holding only the Discord mutations that are really needed.
+apply_plan() then executes it through a MutationQueue and writes the records.
+"""
+
+import datetime as dt
+import hashlib
+import json
+import re
+
+from discord.utils import get
+
+from utils.mutations import MutationQueue
+from utils.text import html_to_text
+
+# Discord limit for text channel topics
+TOPIC_LIMIT = 1024
+
+
+def role_discord_name(prefix, title):
+    return f"{prefix}/{title}" if prefix else title
+
+
+def circle_discord_name(prefix, title):
+    name = re.sub(r'\.', '', title.lower())
+    name = re.sub(r'\s', '-', name)
+    return f"{prefix}-{name}" if prefix else name
+
+
+def find_role(guild, record):
+    """Discord role of a stored role record, by id first and by name for older records"""
+    role = guild.get_role(record['discord_role_id']) if record.get('discord_role_id') else None
+    return role or get(guild.roles, name=record.get('discord_name', ""))
+
+
+def find_channel(guild, record, category=None):
+    """Discord channel of a stored circle record, by id first and by name for older records"""
+    channel = guild.get_channel(record['channel_id']) if record.get('channel_id') else None
+    channels = category.channels if category else guild.channels
+    return channel or get(channels, name=record.get('discord_name', "") + "-circle")
+
+
+class Action:
+    """One step of a Plan: a Discord mutation (or none for 'keep') plus the record write"""
+
+    def __init__(self, op, kind, node_id, name, target=None, changes=None, topic=None, record=None):
+        self.op = op            # create, edit, delete or keep
+        self.kind = kind        # role or channel
+        self.node_id = node_id  # Nestr role_id/circle_id
+        self.name = name
+        self.target = target    # existing Discord object
+        self.changes = changes or {}
+        self.topic = topic
+        self.record = record    # (index, key, fields, insert_fields) or records to remove
+
+    @property
+    def route(self):
+        return f"{self.kind}.{self.op}"
+
+    @property
+    def is_mutation(self):
+        return self.op != 'keep' and not (self.op == 'delete' and self.target is None)
+
+    def describe(self):
+        label = self.name + ("-circle" if self.kind == 'channel' else "")
+        if self.op == 'create':
+            return f"+ {self.kind} `{label}`"
+        if self.op == 'delete':
+            return f"- {self.kind} `{label}`"
+        if self.op == 'edit':
+            parts = []
+            if 'name' in self.changes:
+                parts.append(f"`{self.target.name}` → `{self.changes['name']}`")
+            if 'topic' in self.changes:
+                parts.append("topic")
+            return f"~ {self.kind} `{label}`: " + ", ".join(parts)
+        return f"= {self.kind} `{label}`"
+
+    async def apply(self, guild, category):
+        """Executes the Discord mutation, returns the Discord object it concerns"""
+        if self.op == 'create' and self.kind == 'role':
+            return await guild.create_role(name=self.name, mentionable=True)
+        if self.op == 'create':
+            return await guild.create_text_channel(name=self.name+"-circle", category=category, topic=self.topic)
+        if self.op == 'edit':
+            await self.target.edit(**self.changes)
+        elif self.op == 'delete' and self.target is not None:
+            await self.target.delete()
+        return self.target
+
+
+class Plan:
+    """Ordered list of Actions: creates and edits in tree order, then deletes"""
+
+    def __init__(self):
+        self.actions = []
+
+    def add(self, action):
+        self.actions.append(action)
+
+    @property
+    def mutations(self):
+        return [action for action in self.actions if action.is_mutation]
+
+    def summary(self):
+        counts = {}
+        for action in self.mutations:
+            counts[action.op] = counts.get(action.op, 0) + 1
+        if not counts:
+            return "no changes"
+        return ", ".join(f"{count} {op}" for op, count in sorted(counts.items()))
+
+    def limited(self, max_mutations):
+        """
+        Copy of the plan with every record-only action but at most `max_mutations`
+        mutations; the rest shows up again when the workspace is planned next time.
+        """
+        plan = Plan()
+        budget = max_mutations
+        for action in self.actions:
+            if action.is_mutation:
+                if budget <= 0:
+                    continue
+                budget -= 1
+            plan.add(action)
+        return plan
+
+    def describe(self, limit=1900):
+        lines = [action.describe() for action in self.mutations] or ["Nothing to change."]
+        text = ""
+        for i, line in enumerate(lines):
+            if len(text) + len(line) + 1 > limit:
+                text += f"... and {len(lines) - i} more"
+                break
+            text += line + "\n"
+        return text
+
+
+def desired_state(tree, prefix, workspace_id):
+    """
+    Flattens the Nestr tree into the records it should produce.
+    :return: ({role_id: fields}, {circle_id: fields}) in tree order
+    """
+    roles = {}
+    circles = {}
+
+    def visit(node, node_prefix, circle_id):
+        node_roles, subcircles = node
+        for role in node_roles:
+            title = html_to_text(role.get('title', "No title"))
+            roles[role.get('_id')] = {'role_name': title,
+                                      'discord_name': role_discord_name(node_prefix, title),
+                                      'parent_circle': circle_id,
+                                      'accountabilities': role.get('accountabilities', [])}
+        for subcircle, subtree in subcircles:
+            title = html_to_text(subcircle.get('title', "No title"))
+            name = circle_discord_name(node_prefix, title)
+            circles[subcircle.get('_id')] = {'circle_name': title,
+                                             'discord_name': name,
+                                             'parent_circle': circle_id,
+                                             'purpose': html_to_text(subcircle.get('purpose', ""))[:TOPIC_LIMIT]}
+            visit(subtree, name, subcircle.get('_id'))
+
+    visit(tree, prefix, workspace_id)
+    return roles, circles
+
+
+def state_fingerprint(tree, prefix, workspace_id):
+    """Hash of the records a Nestr tree produces, equal as long as the workspace is unchanged"""
+    roles, circles = desired_state(tree, prefix, workspace_id)
+    payload = json.dumps([prefix, roles, circles], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def stored_state(db, guild_id, workspace_id):
+    """
+    Collects the stored records below a workspace.
+    :return: ({role_id: record}, {circle_id: record})
+    """
+    roles = {}
+    circles = {}
+    stack = [workspace_id]
+    while stack:
+        circle_id = stack.pop()
+        for role in db.child_roles(guild_id, circle_id):
+            roles.setdefault(role.get('role_id'), role)
+        for circle in db.child_circles(guild_id, circle_id):
+            if circle.get('circle_id') not in circles:
+                circles[circle.get('circle_id')] = circle
+                stack.append(circle.get('circle_id'))
+    return roles, circles
+
+
+def plan_workspace(guild, category, db, prefix, workspace_id, tree):
+    """
+    Computes the minimal set of Discord mutations that brings the guild in line
+    with the Nestr tree. Re-planning an unchanged workspace yields no mutations.
+    :param category: the workspace's channel category, None if not created yet
+    """
+    plan = Plan()
+    want_roles, want_circles = desired_state(tree, prefix, workspace_id)
+    have_roles, have_circles = stored_state(db, guild.id, workspace_id)
+    now = dt.datetime.now().isoformat()
+
+    for role_id, want in want_roles.items():
+        record = have_roles.get(role_id)
+        role = find_role(guild, record) if record else get(guild.roles, name=want['discord_name'])
+        fields = {**want, 'sync_at': now}
+        insert_fields = {'role_id': role_id, 'guild_id': guild.id}
+        if role is None:
+            op, changes = 'create', {}
+        elif role.name != want['discord_name']:
+            op, changes = 'edit', {'name': want['discord_name']}
+        else:
+            op, changes = 'keep', {}
+        plan.add(Action(op, 'role', role_id, want['discord_name'], target=role, changes=changes,
+                        record=('role', (guild.id, role_id), fields, insert_fields)))
+
+    for circle_id, want in want_circles.items():
+        record = have_circles.get(circle_id)
+        if record:
+            channel = find_channel(guild, record, category)
+        else:
+            channel = get(category.channels, name=want['discord_name']+"-circle") if category else None
+        fields = {**want, 'updated_at': now}
+        insert_fields = {'circle_id': circle_id, 'guild_id': guild.id}
+        changes = {}
+        if channel is None:
+            op = 'create'
+        else:
+            # compare with the stored name, Discord may normalize channel names further
+            if record and record.get('discord_name') != want['discord_name']:
+                changes['name'] = want['discord_name']+"-circle"
+            if (channel.topic or "") != want['purpose']:
+                changes['topic'] = want['purpose']
+            op = 'edit' if changes else 'keep'
+        plan.add(Action(op, 'channel', circle_id, want['discord_name'], target=channel, changes=changes,
+                        topic=want['purpose'], record=('circle', (guild.id, circle_id), fields, insert_fields)))
+
+    for circle_id, record in have_circles.items():
+        if circle_id not in want_circles:
+            plan.add(Action('delete', 'channel', circle_id, record.get('discord_name', ""),
+                            target=find_channel(guild, record, category), record=[record]))
+    for role_id, record in have_roles.items():
+        if role_id not in want_roles:
+            plan.add(Action('delete', 'role', role_id, record.get('discord_name', ""),
+                            target=find_role(guild, record), record=[record]))
+    return plan
+
+
+async def apply_action(action, guild, category, db):
+    """Runs one action and writes the record it concerns"""
+    target = await action.apply(guild, category)
+    if action.op == 'delete':
+        db.remove(action.record)
+        return
+    index, key, fields, insert_fields = action.record
+    if target is not None:
+        fields = {**fields, ('discord_role_id' if action.kind == 'role' else 'channel_id'): target.id}
+    db.upsert(index, key, fields, insert_fields)
+
+
+def plan_unsync(guild, db, workspace_id):
+    """Plan deleting every channel and role stored below a workspace"""
+    plan = Plan()
+    have_roles, have_circles = stored_state(db, guild.id, workspace_id)
+    for circle_id, record in have_circles.items():
+        plan.add(Action('delete', 'channel', circle_id, record.get('discord_name', ""),
+                        target=find_channel(guild, record), record=[record]))
+    for role_id, record in have_roles.items():
+        plan.add(Action('delete', 'role', role_id, record.get('discord_name', ""),
+                        target=find_role(guild, record), record=[record]))
+    return plan
+
+
+async def apply_plan(plan, guild, category, db, on_progress=None):
+    """
+    Applies a plan: record-only actions right away, Discord mutations through a
+    MutationQueue so they are paced per rate-limit route.
+    :param on_progress: see MutationQueue.run
+    """
+    queue = MutationQueue()
+    for action in plan.actions:
+        if action.is_mutation:
+            queue.add(action.route, lambda action=action: apply_action(action, guild, category, db))
+        else:
+            await apply_action(action, guild, category, db)
+    try:
+        await queue.run(on_progress)
+    finally:
+        db.flush()
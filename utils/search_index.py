@@ -0,0 +1,64 @@
+"""
+In-memory inverted index over the accountabilities of synced roles
+"""
+
+import re
+from bisect import bisect_left
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold())
+
+
+class AccountabilityIndex:
+    """Case-folded token index with prefix matching"""
+
+    def __init__(self):
+        self.entries = []    # (role_id, accountability text)
+        self.postings = {}   # token -> set of entry ids
+        self.vocabulary = [] # sorted tokens, for prefix lookups
+
+    @classmethod
+    def build(cls, entries):
+        """:param entries: iterable of (role_id, accountability text)"""
+        index = cls()
+        for role_id, text in entries:
+            index.add(role_id, text)
+        index.vocabulary = sorted(index.postings)
+        return index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, role_id, text):
+        entry_id = len(self.entries)
+        self.entries.append((role_id, text))
+        for token in tokenize(text):
+            self.postings.setdefault(token, set()).add(entry_id)
+
+    def _matching(self, prefix):
+        ids = set()
+        i = bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            ids |= self.postings[self.vocabulary[i]]
+            i += 1
+        return ids
+
+    def search(self, query):
+        """
+        Returns {role_id: [accountability, ...]} for the accountabilities where
+        every query word is a prefix of one of their words, in index order.
+        """
+        ids = None
+        for token in tokenize(query):
+            matches = self._matching(token)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return {}
+        res = {}
+        for entry_id in sorted(ids or ()):
+            role_id, text = self.entries[entry_id]
+            res.setdefault(role_id, []).append(text)
+        return res
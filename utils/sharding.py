@@ -0,0 +1,102 @@
+"""
+Settings and helpers of the sharded run mode started by launcher.py.
+
+Every worker process runs an AutoShardedBot for its own range of Discord shards.
+Discord delivers the events of a guild, including the `!webhook-*` messages
+posted to it, only to the shard that owns the guild, so each worker handles
+the webhooks, notification DMs, syncs and re-syncs of its own guilds. Records
+are shared through the SQLite backend. Per-process state such as cached
+searches is kept in step with the ShardBus.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 0))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS', '').split(',') if shard_id.strip()]
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', 0))
+SHARD_BUS_PATH = os.getenv('SHARD_BUS_PATH', '/app/shard_bus.sqlite3')
+SHARD_BUS_INTERVAL = float(os.getenv('SHARD_BUS_INTERVAL', 1.0))
+
+
+def is_sharded():
+    return bool(SHARD_IDS)
+
+
+def shard_ranges(shard_count, workers):
+    """Splits shards 0..shard_count-1 into `workers` contiguous, near equal ranges"""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class ShardBus:
+    """
+    Broadcasts small events between the worker processes through a shared SQLite table.
+    Workers poll for events published by the others; events expire after `retention` seconds.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        origin INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path=SHARD_BUS_PATH, worker=WORKER_INDEX, retention=300):
+        self.logger = logging.getLogger(__name__)
+        self.worker = worker
+        self.retention = retention
+        self.handlers = {}
+        self.conn = sqlite3.connect(path, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+        # only events published from now on are of interest
+        self.last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        self._next_prune = time.time() + retention
+
+    def subscribe(self, kind, handler):
+        """:param handler: called as handler(**payload) for every event of `kind` from another worker"""
+        self.handlers[kind] = handler
+
+    def publish(self, kind, **payload):
+        self.conn.execute("INSERT INTO events (origin, kind, payload, created) VALUES (?, ?, ?, ?)",
+                          (self.worker, kind, json.dumps(payload), time.time()))
+        self.conn.commit()
+
+    def poll(self):
+        """Dispatches the events published since the last poll, returns how many were handled"""
+        rows = self.conn.execute("SELECT id, origin, kind, payload FROM events WHERE id > ? ORDER BY id",
+                                 (self.last_id,)).fetchall()
+        handled = 0
+        for event_id, origin, kind, payload in rows:
+            self.last_id = event_id
+            handler = self.handlers.get(kind)
+            if origin == self.worker or handler is None:
+                continue
+            try:
+                handler(**json.loads(payload))
+                handled += 1
+            except Exception:
+                self.logger.exception('Shard bus handler for %s failed', kind)
+        if time.time() >= self._next_prune:
+            self._next_prune = time.time() + self.retention
+            self.conn.execute("DELETE FROM events WHERE created < ?", (time.time() - self.retention,))
+            self.conn.commit()
+        return handled
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,78 @@
+"""
+Registers slash commands only for the scopes whose schema changed.
+
+A stable hash of every scope's command schema (names, options, choices) is
+persisted locally; on boot only scopes with a different hash hit Discord's
+command registration API.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+SLASH_STATE_PATH = os.getenv('SLASH_STATE_PATH', '/app/slash_commands.json')
+SLASH_FORCE_SYNC = os.getenv('SLASH_FORCE_SYNC', '') == '1'
+
+logger = logging.getLogger(__name__)
+
+
+def schema_hash(commands):
+    """Order independent hash of a scope's commands, option order is kept"""
+    normalized = sorted(commands, key=lambda command: (command.get('type', 1), command['name']))
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_hashes(path=SLASH_STATE_PATH):
+    try:
+        with open(path, encoding='utf-8') as handle:
+            return json.load(handle)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_hashes(hashes, path=SLASH_STATE_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump(hashes, handle, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+async def sync_changed_commands(slash, path=SLASH_STATE_PATH, force=SLASH_FORCE_SYNC):
+    """
+    Pushes the commands of every changed scope with one PUT per scope.
+    :param slash: the discord_slash SlashCommand client, created with sync_commands=False
+    :return: list of scopes ('global' or guild ids) that were registered
+    """
+    cmds = await slash.to_dict()
+    scopes = {'global': cmds['global']}
+    for guild_id, guild_cmds in cmds['guild'].items():
+        scopes[str(guild_id)] = guild_cmds
+
+    if any(command.get('permissions') for scope_cmds in scopes.values() for command in scope_cmds):
+        # command permissions need the library's full sync
+        logger.info('Slash commands carry permissions, running full sync')
+        await slash.sync_all_commands()
+        return list(scopes)
+
+    stored = {} if force else load_hashes(path)
+    hashes = {}
+    changed = []
+    for scope, scope_cmds in scopes.items():
+        payload = [{key: value for key, value in command.items() if key != 'permissions'} for command in scope_cmds]
+        hashes[scope] = schema_hash(payload)
+        if stored.get(scope) == hashes[scope]:
+            continue
+        await slash.req.put_slash_commands(slash_commands=payload,
+                                           guild_id=None if scope == 'global' else int(scope))
+        changed.append(scope)
+
+    # scopes that no longer have commands get cleared once
+    for scope in set(stored) - set(scopes):
+        await slash.req.put_slash_commands(slash_commands=[], guild_id=None if scope == 'global' else int(scope))
+        changed.append(scope)
+
+    if changed or hashes != stored:
+        save_hashes(hashes, path)
+    logger.info('Slash commands: %s scopes changed, %s unchanged', len(changed), len(scopes) - len(set(changed) & set(scopes)))
+    return changed
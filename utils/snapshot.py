@@ -0,0 +1,48 @@
+"""
+Local snapshot of the cogs' warm state, so /reload and restarts don't start cold
+"""
+
+import json
+import logging
+import os
+import time
+
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', '/app/warm_state.json')
+# snapshots older than this are ignored altogether
+SNAPSHOT_MAX_AGE = float(os.getenv('SNAPSHOT_MAX_AGE', 900))
+
+logger = logging.getLogger(__name__)
+
+
+def save_snapshot(sections, path=SNAPSHOT_PATH):
+    """
+    Writes the sections atomically, stamped with the current time.
+    :param sections: dict of JSON serializable sections
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as handle:
+            json.dump({'saved_at': time.time(), 'sections': sections}, handle)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as err:
+        logger.warning('Unable to write snapshot %s: %s', path, err)
+
+
+def load_snapshot(path=SNAPSHOT_PATH, max_age=SNAPSHOT_MAX_AGE):
+    """
+    Reads a snapshot written by save_snapshot.
+    :return: (age in seconds, sections), or (None, {}) when missing, unreadable or too old
+    """
+    try:
+        with open(path, encoding='utf-8') as handle:
+            snapshot = json.load(handle)
+    except FileNotFoundError:
+        return None, {}
+    except (OSError, ValueError) as err:
+        logger.warning('Ignoring unreadable snapshot %s: %s', path, err)
+        return None, {}
+    age = max(0.0, time.time() - snapshot.get('saved_at', 0))
+    if age > max_age:
+        logger.info('Ignoring snapshot %s, %.0fs old', path, age)
+        return None, {}
+    return age, snapshot.get('sections', {})
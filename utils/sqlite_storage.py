@@ -0,0 +1,206 @@
+"""
+SQLite storage backend for the cogs.
+
+Same interface as utils.storage.IndexedDB, but records live in SQLite tables
+(WAL mode) with an index behind every lookup NestrCog makes, so the database
+does not have to be parsed into memory and several processes can share it.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from tinydb.table import Document
+
+from utils.metrics import metrics
+from utils.storage import Store
+
+# seconds a write waits for another process' transaction, blocking the event loop meanwhile
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', 1.0))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    discord_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workspaces (
+    guild_id INTEGER NOT NULL,
+    workspace_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, workspace_id)
+);
+CREATE TABLE IF NOT EXISTS circles (
+    guild_id INTEGER NOT NULL,
+    circle_id TEXT NOT NULL,
+    parent_circle TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, circle_id)
+);
+CREATE INDEX IF NOT EXISTS circles_parent ON circles (guild_id, parent_circle);
+CREATE TABLE IF NOT EXISTS roles (
+    guild_id INTEGER NOT NULL,
+    role_id TEXT NOT NULL,
+    parent_circle TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, role_id)
+);
+CREATE INDEX IF NOT EXISTS roles_parent ON roles (guild_id, parent_circle);
+"""
+
+# indexed columns of each table, primary key columns first
+COLUMNS = {
+    'users': ('discord_id',),
+    'workspaces': ('guild_id', 'workspace_id'),
+    'circles': ('guild_id', 'circle_id', 'parent_circle'),
+    'roles': ('guild_id', 'role_id', 'parent_circle'),
+}
+PRIMARY_KEYS = {
+    'users': ('discord_id',),
+    'workspaces': ('guild_id', 'workspace_id'),
+    'circles': ('guild_id', 'circle_id'),
+    'roles': ('guild_id', 'role_id'),
+}
+
+
+def table_for(doc):
+    """Returns the table a record belongs to, the workspace record is also its anchor circle"""
+    if 'discord_id' in doc:
+        return 'users'
+    if 'workspace_id' in doc:
+        return 'workspaces'
+    if 'role_id' in doc:
+        return 'roles'
+    if 'circle_id' in doc:
+        return 'circles'
+    raise ValueError(f"Unknown record type: {sorted(doc)}")
+
+
+class SQLiteDB(Store):
+    """
+    SQLite backed store. Every write call commits its own short transaction: an open
+    transaction holds the database's write lock, which other worker processes wait on.
+    There is no write-behind, so nothing is ever dirty and flush() has nothing to do.
+    """
+
+    # same interface as the write-behind IndexedDB
+    dirty = 0
+
+    def __init__(self, path, busy_timeout=DB_BUSY_TIMEOUT):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        # autocommit, transactions are opened explicitly in _transaction
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def flush(self, durable=False):
+        # writes are committed as they happen
+        pass
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """One write transaction, it must never be held across an await"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _select(self, table, where="", params=()):
+        sql = f"SELECT rowid, data FROM {table}"
+        if where:
+            sql += " WHERE " + where
+        with metrics.timer('nestr_storage_seconds', backend='SQLiteDB', op='select'):
+            rows = self.conn.execute(sql + " ORDER BY rowid", params).fetchall()
+        return [Document(json.loads(data), rowid) for rowid, data in rows]
+
+    def _write(self, table, doc):
+        columns = COLUMNS[table]
+        values = [str(doc.get(col)) if col == 'discord_id' else doc.get(col) for col in columns]
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}, data) VALUES ({', '.join('?' * (len(columns) + 1))})",
+            (*values, json.dumps(doc)))
+
+    def _delete(self, table, doc):
+        keys = PRIMARY_KEYS[table]
+        self.conn.execute(f"DELETE FROM {table} WHERE " + " AND ".join(f"{key} = ?" for key in keys),
+                          tuple(str(doc[key]) if key == 'discord_id' else doc[key] for key in keys))
+
+    def all(self):
+        return [doc for table in COLUMNS for doc in self._select(table)]
+
+    def find(self, index, key):
+        if index == 'discord_id':
+            return self.user(key)
+        if index == 'guild':
+            return [doc for table in COLUMNS if table != 'users'
+                    for doc in self._select(table, "guild_id = ?", (key,))]
+        if index == 'role':
+            return self.role(*key)
+        if index == 'circle':
+            return self.circle(*key)
+        if index == 'workspace':
+            return self.workspace(*key)
+        if index == 'parent_circle':
+            return self.child_roles(*key) + self.child_circles(*key)
+        raise KeyError(index)
+
+    def insert(self, fields):
+        doc = Document(dict(fields), None)
+        with self._transaction():
+            self._write(table_for(doc), doc)
+        return doc
+
+    def update(self, fields, docs):
+        if not docs:
+            return
+        with self._transaction():
+            for doc in docs:
+                table = table_for(doc)
+                self._delete(table, doc)
+                doc.update(fields)
+                self._write(table, doc)
+
+    def remove(self, docs):
+        if not docs:
+            return
+        with self._transaction():
+            for doc in docs:
+                self._delete(table_for(doc), doc)
+
+    # typed lookups used by the cogs
+    def user(self, discord_id):
+        return self._select('users', "discord_id = ?", (str(discord_id),))
+
+    def roles(self, guild_id):
+        return self._select('roles', "guild_id = ?", (guild_id,))
+
+    def circles(self, guild_id):
+        return self._select('circles', "guild_id = ?", (guild_id,)) + self.workspaces(guild_id)
+
+    def workspaces(self, guild_id):
+        return self._select('workspaces', "guild_id = ?", (guild_id,))
+
+    def role(self, guild_id, role_id):
+        return self._select('roles', "guild_id = ? AND role_id = ?", (guild_id, role_id))
+
+    def circle(self, guild_id, circle_id):
+        return (self._select('circles', "guild_id = ? AND circle_id = ?", (guild_id, circle_id))
+                or self.workspace(guild_id, circle_id))
+
+    def workspace(self, guild_id, workspace_id):
+        return self._select('workspaces', "guild_id = ? AND workspace_id = ?", (guild_id, workspace_id))
+
+    def child_roles(self, guild_id, circle_id):
+        return self._select('roles', "guild_id = ? AND parent_circle = ?", (guild_id, circle_id))
+
+    def child_circles(self, guild_id, circle_id):
+        return self._select('circles', "guild_id = ? AND parent_circle = ?", (guild_id, circle_id))
@@ -0,0 +1,253 @@
+"""
+Indexed storage layer on top of the TinyDB store used by the cogs.
+
+TinyDB answers every Query with a scan over all records of every guild.
+IndexedDB keeps the records in memory together with hash indexes on the keys
+the cogs look up, so lookups cost the same no matter how many guilds are served.
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+from tinydb import TinyDB
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import Storage
+from tinydb.table import Document
+
+from utils.metrics import metrics
+
+DB_BACKEND = os.getenv('DB_BACKEND', 'json')
+DB_PATH = os.getenv('DB_PATH')
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', 2.0))
+DB_FLUSH_THRESHOLD = int(os.getenv('DB_FLUSH_THRESHOLD', 200))
+
+
+class AtomicJSONStorage(Storage):
+    """JSON file storage that replaces the file atomically on every write"""
+
+    def __init__(self, path, encoding='utf-8', **kwargs):
+        self.path = path
+        self.encoding = encoding
+        self.kwargs = kwargs
+
+    def read(self):
+        try:
+            with open(self.path, encoding=self.encoding) as handle:
+                content = handle.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(content) if content.strip() else None
+
+    def write(self, data):
+        # write to a temp file first so a crash never leaves a truncated db
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding=self.encoding) as handle:
+            handle.write(json.dumps(data, **self.kwargs))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def _guild_key(field):
+    def key(doc):
+        if field in doc and 'guild_id' in doc:
+            return (doc['guild_id'], doc[field])
+        return None
+    return key
+
+
+class Store:
+    """Operations shared by the storage backends, built on their find, insert and update"""
+
+    def upsert(self, index, key, fields, insert_fields=None):
+        """
+        Updates the records matching the index key, or inserts a new one.
+        :param insert_fields: extra fields only written when inserting
+        """
+        with metrics.timer('nestr_storage_seconds', backend=type(self).__name__, op='upsert'):
+            docs = self.find(index, key)
+            if docs:
+                self.update(fields, docs)
+            else:
+                self.insert({**(insert_fields or {}), **fields})
+
+
+class WriteBehind(Store):
+    """
+    Group-commit flush policy of the JSON backend.
+    Subclasses count writes in `self.dirty` and implement _persist().
+    """
+
+    def __init__(self, flush_interval=DB_FLUSH_INTERVAL, flush_threshold=DB_FLUSH_THRESHOLD):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.dirty = 0
+        self._flush_handle = None
+
+    def _persist(self):
+        raise NotImplementedError
+
+    def flush(self, durable=False):
+        """
+        Write-behind flush: dirty records are written once `flush_interval`
+        seconds have passed or `flush_threshold` records are dirty.
+        :param durable: write to disk right now, e.g. after storing a login token
+        """
+        if durable or self.dirty >= self.flush_threshold:
+            self._flush_now()
+            return
+        if self._flush_handle is None and self.dirty:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._flush_now()
+                return
+            self._flush_handle = loop.call_later(self.flush_interval, self._flush_now)
+
+    def _flush_now(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self.dirty:
+            with metrics.timer('nestr_storage_seconds', backend=type(self).__name__, op='flush'):
+                self._persist()
+            self.logger.debug('Flushed %s dirty records', self.dirty)
+            self.dirty = 0
+
+
+class IndexedDB(WriteBehind):
+    """TinyDB wrapper with hash indexes, updated on insert, update and remove"""
+
+    INDEXES = {
+        'discord_id': lambda doc: doc.get('discord_id'),
+        'guild': lambda doc: doc.get('guild_id'),
+        'role': _guild_key('role_id'),
+        'circle': _guild_key('circle_id'),
+        'workspace': _guild_key('workspace_id'),
+        'parent_circle': _guild_key('parent_circle'),
+    }
+
+    def __init__(self, db, flush_interval=DB_FLUSH_INTERVAL, flush_threshold=DB_FLUSH_THRESHOLD):
+        super().__init__(flush_interval, flush_threshold)
+        self.logger = logging.getLogger(__name__)
+        self.db = db
+        self._docs = {}
+        self._indexes = {name: {} for name in self.INDEXES}
+        for doc in db.all():
+            self._add(doc)
+        self.logger.info('Indexed %s records', len(self._docs))
+
+    @property
+    def storage(self):
+        return self.db.storage
+
+    def _persist(self):
+        self.db.storage.flush()
+
+    def close(self):
+        self._flush_now()
+        self.db.close()
+
+    def _add(self, doc):
+        self._docs[doc.doc_id] = doc
+        for name, key_fn in self.INDEXES.items():
+            key = key_fn(doc)
+            if key is not None:
+                self._indexes[name].setdefault(key, set()).add(doc.doc_id)
+
+    def _discard(self, doc):
+        self._docs.pop(doc.doc_id, None)
+        for name, key_fn in self.INDEXES.items():
+            key = key_fn(doc)
+            ids = self._indexes[name].get(key)
+            if ids is not None:
+                ids.discard(doc.doc_id)
+                if not ids:
+                    del self._indexes[name][key]
+
+    def all(self):
+        return list(self._docs.values())
+
+    def find(self, index, key):
+        """
+        Returns the records whose `index` key equals `key`, in insertion order.
+        :param index: one of INDEXES
+        :param key: the indexed value, e.g. (guild_id, role_id) for 'role'
+        """
+        return [self._docs[doc_id] for doc_id in sorted(self._indexes[index].get(key, ()))]
+
+    def insert(self, fields):
+        doc_id = self.db.insert(fields)
+        self.dirty += 1
+        doc = Document(dict(fields), doc_id)
+        self._add(doc)
+        return doc
+
+    def update(self, fields, docs):
+        if not docs:
+            return
+        self.db.update(fields, doc_ids=[doc.doc_id for doc in docs])
+        self.dirty += len(docs)
+        for doc in docs:
+            self._discard(doc)
+            doc.update(fields)
+            self._add(doc)
+
+    def remove(self, docs):
+        if not docs:
+            return
+        self.db.remove(doc_ids=[doc.doc_id for doc in docs])
+        self.dirty += len(docs)
+        for doc in docs:
+            self._discard(doc)
+
+    # typed lookups used by the cogs
+    def user(self, discord_id):
+        return self.find('discord_id', str(discord_id))
+
+    def roles(self, guild_id):
+        return [doc for doc in self.find('guild', guild_id) if 'role_id' in doc]
+
+    def circles(self, guild_id):
+        return [doc for doc in self.find('guild', guild_id) if 'circle_id' in doc]
+
+    def workspaces(self, guild_id):
+        return [doc for doc in self.find('guild', guild_id) if 'workspace_name' in doc]
+
+    def role(self, guild_id, role_id):
+        return self.find('role', (guild_id, role_id))
+
+    def circle(self, guild_id, circle_id):
+        return self.find('circle', (guild_id, circle_id))
+
+    def workspace(self, guild_id, workspace_id):
+        return self.find('workspace', (guild_id, workspace_id))
+
+    def child_roles(self, guild_id, circle_id):
+        return [doc for doc in self.find('parent_circle', (guild_id, circle_id)) if 'role_id' in doc]
+
+    def child_circles(self, guild_id, circle_id):
+        return [doc for doc in self.find('parent_circle', (guild_id, circle_id)) if 'circle_id' in doc]
+
+
+def open_json_db(path):
+    db = TinyDB(path, storage=CachingMiddleware(AtomicJSONStorage))
+    # IndexedDB owns the flush policy, never let the middleware flush on its own
+    db.storage.WRITE_CACHE_SIZE = float('inf')
+    return IndexedDB(db)
+
+
+def open_db(path=DB_PATH, backend=DB_BACKEND):
+    """
+    Opens the bot database with write-behind flushing.
+    :param path: database file, defaults to /app/db.json or /app/db.sqlite3
+    :param backend: 'json' (TinyDB) or 'sqlite'
+    """
+    if backend == 'sqlite':
+        from utils.sqlite_storage import SQLiteDB
+        return SQLiteDB(path or '/app/db.sqlite3')
+    if backend != 'json':
+        raise ValueError(f"Unknown DB_BACKEND '{backend}'")
+    return open_json_db(path or '/app/db.json')
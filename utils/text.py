@@ -0,0 +1,56 @@
+"""
+Fast, memoized HTML-to-text sanitizing for Nestr titles and purposes, and
+clipping of text to Discord's embed limits
+"""
+
+import functools
+import os
+
+from bs4 import BeautifulSoup as bs
+
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:  # pragma: no cover - lxml is in requirements.txt
+    lxml_html = None
+
+TEXT_CACHE_SIZE = int(os.getenv('TEXT_CACHE_SIZE', 8192))
+
+# Discord embed limits
+EMBED_TOTAL = 6000
+EMBED_FIELDS = 25
+FIELD_NAME = 256
+FIELD_VALUE = 1024
+
+
+def clip(text, limit):
+    """Shortens text to `limit` characters, empty text becomes "..." which Discord accepts"""
+    text = str(text) if text else "..."
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _parse(raw):
+    if lxml_html is not None:
+        try:
+            return lxml_html.fragment_fromstring(raw, create_parent='div').text_content()
+        except (etree.ParserError, ValueError):
+            pass
+    return bs(raw, "html.parser").text
+
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _html_to_text(raw):
+    # most Nestr titles carry no markup at all
+    if '<' not in raw and '&' not in raw:
+        return raw
+    return _parse(raw)
+
+
+def html_to_text(raw):
+    """
+    Returns the text content of an HTML snippet, same as
+    BeautifulSoup(raw, "html.parser").text but memoized and without parsing
+    plain strings.
+    """
+    if not raw:
+        return ""
+    return _html_to_text(raw)
@@ -0,0 +1,139 @@
+"""
+Event loop stall detector.
+
+A heartbeat coroutine stamps the time on every tick. A watchdog thread notices
+when the stamp gets older than the threshold, meaning a callback is holding
+the loop, and captures the loop thread's stack together with the slash command
+or listener that is running. Stall reports go to the `stalls` logger and are
+summarized as the top offenders by total blocked time.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+from utils.metrics import metrics
+
+STALL_WATCHDOG = os.getenv('STALL_WATCHDOG', '') == '1'
+STALL_THRESHOLD = float(os.getenv('STALL_THRESHOLD', 0.25))
+STALL_SUMMARY_INTERVAL = float(os.getenv('STALL_SUMMARY_INTERVAL', 300))
+
+# frames from these directories are the bot's own code
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _is_project_frame(frame):
+    filename = os.path.abspath(frame.f_code.co_filename)
+    return filename.startswith(PROJECT_DIR) and 'site-packages' not in filename and filename != __file__
+
+
+def describe_stack(frame):
+    """
+    Finds where a stack came from and which of our lines was running.
+    :return: (origin, site), e.g. ('/todos', 'cogs/nestr.py:412 todos')
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    origin = None
+    site = None
+    for frame in frames:
+        if not _is_project_frame(frame):
+            continue
+        ctx = frame.f_locals.get('ctx')
+        if origin is None and getattr(ctx, 'name', None) and hasattr(ctx, 'interaction_id'):
+            origin = '/' + ctx.name
+        elif origin is None and os.path.basename(os.path.dirname(frame.f_code.co_filename)) == 'cogs':
+            # listeners and helpers of a cog, e.g. on_message
+            origin = frame.f_code.co_name
+        site = f"{os.path.relpath(frame.f_code.co_filename, PROJECT_DIR)}:{frame.f_lineno} {frame.f_code.co_name}"
+    return origin or 'unknown', site or 'outside the bot'
+
+
+class StallWatchdog:
+    """Reports callbacks that hold the event loop longer than `threshold` seconds"""
+
+    def __init__(self, threshold=STALL_THRESHOLD, summary_interval=STALL_SUMMARY_INTERVAL):
+        self.logger = logging.getLogger('stalls')
+        self.threshold = threshold
+        self.interval = threshold / 2
+        self.summary_interval = summary_interval
+        self.offenders = {}
+        self.stalls = 0
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+        self._beat = None
+        self._loop_thread = None
+        self._loop = None
+
+    async def heartbeat(self):
+        """Runs on the event loop for as long as the bot does"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        threading.Thread(target=self._watch, name='stall-watchdog', daemon=True).start()
+        while True:
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return 'unknown', 'outside the bot', ''
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        origin, site = describe_stack(frame)
+        stack = ''.join(traceback.format_stack(frame))
+        if task is not None:
+            stack = f"task {task.get_name()}: {task.get_coro().__qualname__}\n" + stack
+        return origin, site, stack
+
+    def _watch(self):
+        stalled = None
+        next_summary = time.monotonic() + self.summary_interval
+        while True:
+            time.sleep(self.interval / 2)
+            beat = self._beat
+            now = time.monotonic()
+            if stalled is None:
+                if now - beat > self.interval + self.threshold:
+                    stalled = (beat, *self._capture())
+            elif beat != stalled[0]:
+                self._record(beat - stalled[0] - self.interval, *stalled[1:])
+                stalled = None
+            if now >= next_summary:
+                next_summary = now + self.summary_interval
+                self.log_summary()
+
+    def _record(self, seconds, origin, site, stack):
+        with self._lock:
+            self.stalls += 1
+            self.blocked_seconds += seconds
+            entry = self.offenders.setdefault((origin, site), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+        metrics.observe('nestr_loop_stall_seconds', seconds, origin=origin)
+        self.logger.warning('Event loop blocked for %.3fs by %s at %s\n%s', seconds, origin, site, stack)
+
+    def top(self, limit=10):
+        """
+        Offenders sorted by total blocked time.
+        :return: list of (origin, site, count, total seconds, max seconds)
+        """
+        with self._lock:
+            rows = [(origin, site, *entry) for (origin, site), entry in self.offenders.items()]
+        return sorted(rows, key=lambda row: row[3], reverse=True)[:limit]
+
+    def log_summary(self, limit=10):
+        rows = self.top(limit)
+        if not rows:
+            return
+        self.logger.info('Top event loop stalls (%s stalls, %.2fs blocked):\n%s', self.stalls, self.blocked_seconds,
+                         '\n'.join(f'{total:8.2f}s {count:5d}x max {worst:.2f}s  {origin}  {site}'
+                                   for origin, site, count, total, worst in rows))
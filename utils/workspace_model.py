@@ -0,0 +1,92 @@
+"""
+Hot in-memory model of the workspaces synced to a guild.
+
+Built once per guild from the stored records and rebuilt after /sync and
+/unsync, so commands can filter and group results with dict lookups instead of
+rescanning the database on every call.
+"""
+
+from utils.search_index import AccountabilityIndex
+
+
+class CircleNode:
+    """A synced circle, or the anchor circle of a workspace"""
+    __slots__ = ('id', 'name', 'discord_name', 'parent', 'children', 'roles', 'is_workspace')
+
+    def __init__(self, id, name, discord_name, is_workspace=False):
+        self.id = id
+        self.name = name
+        self.discord_name = discord_name
+        self.parent = None
+        self.children = []
+        self.roles = []
+        self.is_workspace = is_workspace
+
+    def __repr__(self):
+        return f"<CircleNode {self.id} {self.name!r}>"
+
+
+class RoleNode:
+    """A synced role"""
+    __slots__ = ('id', 'name', 'discord_name', 'parent', 'accountabilities')
+
+    def __init__(self, id, name, discord_name, accountabilities=()):
+        self.id = id
+        self.name = name
+        self.discord_name = discord_name
+        self.parent = None
+        self.accountabilities = list(accountabilities)
+
+    def __repr__(self):
+        return f"<RoleNode {self.id} {self.name!r}>"
+
+
+class GuildModel:
+    """id -> node and discord name -> node maps of every workspace synced to a guild"""
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.workspaces = {}
+        self.circles = {}
+        self.roles = {}
+        self.by_discord_name = {}
+        self._acc_index = None
+
+    @classmethod
+    def from_db(cls, db, guild_id):
+        model = cls(guild_id)
+        for record in db.circles(guild_id):
+            is_workspace = 'workspace_id' in record
+            node = CircleNode(record.get('circle_id'), record.get('circle_name'), record.get('discord_name'), is_workspace)
+            model.circles[node.id] = node
+            if is_workspace:
+                model.workspaces[node.id] = node
+            model.by_discord_name.setdefault(node.discord_name, node)
+        for record in db.circles(guild_id):
+            node = model.circles[record.get('circle_id')]
+            parent = model.circles.get(record.get('parent_circle'))
+            if parent is not None and parent is not node:
+                node.parent = parent
+                parent.children.append(node)
+        for record in db.roles(guild_id):
+            node = RoleNode(record.get('role_id'), record.get('role_name'), record.get('discord_name'),
+                            record.get('accountabilities') or ())
+            model.roles[node.id] = node
+            model.by_discord_name[node.discord_name] = node
+            parent = model.circles.get(record.get('parent_circle'))
+            if parent is not None:
+                node.parent = parent
+                parent.roles.append(node)
+        return model
+
+    def role_by_discord_name(self, name):
+        node = self.by_discord_name.get(name)
+        return node if isinstance(node, RoleNode) else None
+
+    @property
+    def accountabilities(self):
+        """AccountabilityIndex over the synced roles, built on first use"""
+        if self._acc_index is None:
+            self._acc_index = AccountabilityIndex.build((role.id, text) for role in self.roles.values()
+                                                        for text in role.accountabilities)
+        return self._acc_index